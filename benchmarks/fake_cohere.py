@@ -0,0 +1,58 @@
+# benchmarks/fake_cohere.py
+# Local stand-in for cohere.ClientV2 / AsyncClientV2 so the pipeline can be
+# benchmarked end to end without network calls or API costs. Only the parts
+# of the response objects read by CohereProvider (src/llm_providers.py) are provided.
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+
+class FakeCohereClient:
+    """
+    Mimics `co.chat` / `co.chat_stream`: sleeps for latency_ms (+/- jitter_ms)
+    and answers with a short canned text built from the prompt length.
+    """
+
+    def __init__(self, latency_ms=800.0, jitter_ms=0.0, stream_chunks=20, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.stream_chunks = max(1, stream_chunks)
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    def _delay(self):
+        jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000.0
+
+    def _answer(self, messages):
+        prompt = messages[-1]["content"] if messages else ""
+        return f"Benchmark answer for a {len(prompt)}-character prompt."
+
+    @staticmethod
+    def _response(text):
+        return SimpleNamespace(message=SimpleNamespace(content=[SimpleNamespace(text=text)]))
+
+    def chat(self, model=None, messages=None, max_tokens=None, temperature=None, **kwargs):
+        self.calls += 1
+        time.sleep(self._delay())
+        return self._response(self._answer(messages))
+
+    def chat_stream(self, model=None, messages=None, max_tokens=None, temperature=None, **kwargs):
+        self.calls += 1
+        text = self._answer(messages)
+        step = self._delay() / self.stream_chunks
+        size = max(1, len(text) // self.stream_chunks)
+        for i in range(0, len(text), size):
+            time.sleep(step)
+            yield SimpleNamespace(
+                type="content-delta",
+                delta=SimpleNamespace(message=SimpleNamespace(content=SimpleNamespace(text=text[i:i + size]))),
+            )
+
+class FakeAsyncCohereClient(FakeCohereClient):
+    """Mimics `co_async.chat` (cohere.AsyncClientV2)."""
+
+    async def chat(self, model=None, messages=None, max_tokens=None, temperature=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        return self._response(self._answer(messages))
@@ -0,0 +1,146 @@
+# benchmarks/fake_cohere_server.py
+# Local HTTP stand-in for the Cohere v2 chat endpoint, for exercising the
+# timeouts, retries, hedging and circuit breaker in src/resilience.py against
+# a real client and socket. Latency, a slow tail and error responses can be
+# injected. Point the app at it with:
+#
+#   python benchmarks/fake_cohere_server.py --port 8099 --error-rate 0.2 --slow-rate 0.05
+#   COHERE_BASE_URL=http://127.0.0.1:8099 COHERE_API_KEY=fake streamlit run src/app.py
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeCohereHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"message": "invalid JSON"})
+            return
+        if self.path.rstrip("/") != "/v2/chat":
+            self._send_json(404, {"message": f"unknown path {self.path}"})
+            return
+
+        server = self.server
+        delay, fail = server.plan()
+        server.requests += 1
+        time.sleep(delay)
+        if fail:
+            self._send_json(server.error_status, {"message": "injected failure"})
+            return
+
+        messages = request.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        text = f"Fake answer for a {len(prompt)}-character prompt."
+        if request.get("stream"):
+            self._stream(text)
+            return
+        self._send_json(200, {
+            "id": str(uuid.uuid4()),
+            "finish_reason": "COMPLETE",
+            "message": {"role": "assistant", "content": [{"type": "text", "text": text}]},
+            "usage": {"billed_units": {"input_tokens": len(prompt.split()), "output_tokens": len(text.split())}},
+        })
+
+    def _stream(self, text):
+        """Server-sent events in the order the v2 chat stream produces them."""
+        events = [
+            {"type": "message-start", "id": str(uuid.uuid4()), "delta": {"message": {"role": "assistant"}}},
+            {"type": "content-start", "index": 0, "delta": {"message": {"content": {"type": "text", "text": ""}}}},
+        ]
+        events += [{"type": "content-delta", "index": 0, "delta": {"message": {"content": {"text": word + " "}}}}
+                   for word in text.split()]
+        events += [{"type": "content-end", "index": 0},
+                   {"type": "message-end", "delta": {"finish_reason": "COMPLETE"}}]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for event in events:
+            self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeCohereServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=200.0, jitter_ms=0.0, slow_rate=0.0, slow_ms=5000.0,
+                 error_rate=0.0, error_status=503, seed=0):
+        super().__init__(address, FakeCohereHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def plan(self):
+        """(delay in seconds, fail?) for the next request."""
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+            delay = max(0.0, self.latency_ms + jitter)
+            if self._random.random() < self.slow_rate:
+                delay = self.slow_ms
+            return delay / 1000.0, self._random.random() < self.error_rate
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start_fake_cohere_server(port=0, **options):
+    """Starts the server on 127.0.0.1 in a daemon thread; returns it (see .base_url)."""
+    server = FakeCohereServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, name="fake-cohere", daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local fake of the Cohere v2 chat API")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests taking --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=5000.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = FakeCohereServer(("127.0.0.1", args.port), latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                              slow_rate=args.slow_rate, slow_ms=args.slow_ms, error_rate=args.error_rate,
+                              error_status=args.error_status, seed=args.seed)
+    print(f"🧪 Fake Cohere API on {server.base_url} (pid {os.getpid()})")
+    print(f"   export COHERE_BASE_URL={server.base_url} COHERE_API_KEY=fake")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n👋 Served {server.requests} requests")
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+# benchmarks/run_benchmarks.py
+# Benchmarks for the RAG pipeline: ingest throughput, query encoding, vector
+# search, context building and end-to-end generate_answer (with a local
+# stand-in for Cohere). Everything runs against a throwaway copy of the data
+# in a temp directory, so the real indices and caches are never touched.
+#
+#   python benchmarks/run_benchmarks.py --output results.json
+#   python benchmarks/run_benchmarks.py --output new.json --baseline results.json
+#   python benchmarks/run_benchmarks.py --compare results.json new.json
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATA = os.path.join(REPO_ROOT, "data", "faq_data.json")
+# latency stats compared between runs, and how much worse counts as a regression
+COMPARED_LATENCIES = ("p50_ms", "p95_ms")
+COMPARED_THROUGHPUTS = ("docs_per_s", "chunks_per_s")
+
+def percentile_stats(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    import numpy as np
+
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    if not len(ms):
+        return {"n": 0}
+    return {
+        "n": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+def timed_samples(fn, items, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+def benchmark_questions(data_path, limit):
+    """Issue / SubIssue fields of the FAQ records, used as realistic queries."""
+    with open(data_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    questions = []
+    for record in records:
+        for field in ("Issue", "SubIssue", "SubIssue1"):
+            text = (record.get(field) or "").strip()
+            if text:
+                questions.append(text)
+    return questions[:limit] if limit else questions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def prepare_environment(workdir, data_path, args):
+    """Point every path the pipeline reads at `workdir`; must run before importing src.*"""
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    shutil.copy(data_path, data_dir)
+    os.environ.update({
+        "DATA_DIR": data_dir,
+        "INDICES_DIR": os.path.join(workdir, "indices"),
+        "EMBED_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "RESPONSE_CACHE_PATH": os.path.join(workdir, "response_cache.db"),
+        "TICKETS_DB_PATH": os.path.join(workdir, "tickets.db"),
+        "COHERE_API_KEY": os.environ.get("COHERE_API_KEY") or "benchmark",
+    })
+    os.environ.setdefault("EMBEDDING_SERVER", "off")
+    if not args.with_caches:
+        # measure the uncached path: every question is encoded, searched and "generated"
+        os.environ.update({"QUERY_CACHE_SIZE": "0", "ANSWER_CACHE_SIZE": "0", "RESPONSE_CACHE_MAX_ENTRIES": "0"})
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    try:
+        prepare_environment(workdir, args.data, args)
+        sys.path.insert(0, REPO_ROOT)
+        from benchmarks.fake_cohere import FakeAsyncCohereClient, FakeCohereClient
+        from src import ingest, retriever as retriever_mod, generator
+        from src.embeddings import load_embedding_model
+        from src.llm_providers import CohereProvider, LLMRouter
+
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "settings": {
+                    "data": os.path.relpath(args.data, REPO_ROOT),
+                    "queries": args.queries,
+                    "repeat": args.repeat,
+                    "top_k": args.top_k,
+                    "llm_latency_ms": args.llm_latency_ms,
+                    "with_caches": args.with_caches,
+                    "retriever_backend": retriever_mod.RETRIEVER_BACKEND,
+                    "retriever_mode": retriever_mod.RETRIEVER_MODE,
+                },
+            },
+            "stages": {},
+        }
+        stages = results["stages"]
+
+        # --- ingest throughput (full rebuild with a cold embedding cache) ---
+        docs = ingest.load_documents()
+        n_chunks = len(ingest.split_documents(docs))
+        durations = []
+        for _ in range(args.ingest_runs):
+            if os.path.exists(ingest.EMBED_CACHE_PATH):
+                os.remove(ingest.EMBED_CACHE_PATH)
+            start = time.perf_counter()
+            ingest.create_chroma_index(batch_size=args.batch_size)
+            durations.append(time.perf_counter() - start)
+        best = min(durations)
+        stages["ingest"] = {
+            "docs": len(docs),
+            "chunks": n_chunks,
+            "seconds": best,
+            "docs_per_s": len(docs) / best,
+            "chunks_per_s": n_chunks / best,
+        }
+
+        questions = benchmark_questions(args.data, args.queries)
+        model = load_embedding_model()
+        model.encode(questions[:1], convert_to_numpy=True, show_progress_bar=False)  # warm up
+
+        # --- single-query encode latency (batch of 1, as in get_relevant_documents) ---
+        stages["query_encode"] = percentile_stats(timed_samples(
+            lambda q: model.encode([q], convert_to_numpy=True, show_progress_bar=False), questions, args.repeat))
+
+        # --- vector search latency with precomputed query embeddings ---
+        retriever = retriever_mod.load_retriever(k=args.top_k)
+        embs = model.encode(questions, convert_to_numpy=True, show_progress_bar=False)
+        stages["vector_search"] = percentile_stats(timed_samples(
+            lambda emb: retriever._dense_search([emb], args.top_k, None), list(embs), args.repeat))
+
+        # --- context building over the retrieved documents ---
+        retrieved = [retriever.get_relevant_documents(q) for q in questions]
+        stages["context_build"] = percentile_stats(timed_samples(
+            generator.build_context_snippet, retrieved, args.repeat))
+
+        # --- end-to-end generate_answer with the Cohere stand-in ---
+        generator.llm_router = LLMRouter([CohereProvider(
+            client=FakeCohereClient(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms),
+            async_client=FakeAsyncCohereClient(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms),
+        )])
+        # don't time a failure path as if it were an answer
+        probe = generator.generate_answer(questions[0], top_k=args.top_k)["answer"]
+        if probe.startswith("Retrieval error") or generator._is_error_text(probe):
+            raise RuntimeError(f"generate_answer failed during the benchmark: {probe}")
+        stages["generate_answer"] = percentile_stats(timed_samples(
+            lambda q: generator.generate_answer(q, top_k=args.top_k), questions, args.repeat))
+        stages["generate_answer"]["llm_latency_ms"] = args.llm_latency_ms
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(baseline, current, threshold):
+    """
+    Lines describing each stage's change vs the baseline, and whether any
+    latency grew or throughput dropped by more than `threshold` (a fraction).
+    """
+    lines, regressed = [], False
+    for stage, now in current.get("stages", {}).items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before:
+            lines.append(f"  {stage:<16} (new)")
+            continue
+        for key in COMPARED_LATENCIES + COMPARED_THROUGHPUTS:
+            if key not in now or not before.get(key):
+                continue
+            change = now[key] / before[key] - 1.0
+            worse = change > threshold if key in COMPARED_LATENCIES else change < -threshold
+            regressed |= worse
+            flag = "  REGRESSION" if worse else ""
+            lines.append(f"  {stage:<16} {key:<13} {before[key]:>10.2f} -> {now[key]:>10.2f} ({change:+.1%}){flag}")
+    return lines, regressed
+
+def print_results(results):
+    for stage, stats in results["stages"].items():
+        if "docs_per_s" in stats:
+            print(f"  {stage:<16} {stats['docs']} docs, {stats['chunks']} chunks in {stats['seconds']:.2f}s "
+                  f"({stats['docs_per_s']:.1f} docs/s, {stats['chunks_per_s']:.1f} chunks/s)")
+        else:
+            print(f"  {stage:<16} n={stats['n']:<5} p50={stats['p50_ms']:8.2f} ms  "
+                  f"p95={stats['p95_ms']:8.2f} ms  p99={stats['p99_ms']:8.2f} ms")
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RAG pipeline.")
+    parser.add_argument("--data", default=DEFAULT_DATA, help="FAQ JSON file to ingest and query")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="results JSON to compare this run against")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="only compare two existing results files")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown flagged as a regression (default 0.2 = 20%%)")
+    parser.add_argument("--queries", type=int, default=100, help="max questions taken from the data (0 = all)")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the questions per latency stage")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=64, help="ingest batch size")
+    parser.add_argument("--ingest-runs", type=int, default=1, help="full rebuilds timed (best is reported)")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0, help="simulated Cohere latency")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0, help="uniform +/- jitter on the latency")
+    parser.add_argument("--with-caches", action="store_true",
+                        help="keep the query/answer/response caches enabled (repeated questions hit them)")
+    args = parser.parse_args()
+
+    if args.compare:
+        baseline, current = (load_json(path) for path in args.compare)
+    else:
+        args.data = os.path.abspath(args.data)
+        current = run(args)
+        print(f"📊 Benchmark results (commit {current['meta']['commit']}):")
+        print_results(current)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(current, f, indent=2)
+            print(f"✅ Results written to {args.output}")
+        baseline = load_json(args.baseline) if args.baseline else None
+
+    if baseline is not None:
+        lines, regressed = compare(baseline, current, args.threshold)
+        print(f"🔍 vs baseline (commit {baseline.get('meta', {}).get('commit')}):")
+        print("\n".join(lines))
+        if regressed:
+            print(f"❌ Regression beyond {args.threshold:.0%} detected")
+            sys.exit(1)
+        print("✅ No regressions")
+
+if __name__ == "__main__":
+    main()
@@ -9,3 +9,20 @@ os.makedirs(cache_dir, exist_ok=True)
 print("📥 Downloading embedding model to", cache_dir)
 model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2', cache_folder=cache_dir)
 print(f"✅ Embedding model downloaded to {cache_dir}")
+
+# Chat-model tokenizer used to budget prompt context (src/context_packer.py)
+from src.context_packer import CONTEXT_TOKENIZER_PATH, download_tokenizer
+
+print("📥 Downloading context tokenizer to", CONTEXT_TOKENIZER_PATH)
+download_tokenizer()
+print(f"✅ Context tokenizer saved to {CONTEXT_TOKENIZER_PATH}")
+
+# Optional: int8-quantized ONNX export for CPU-only serving (EMBEDDING_BACKEND=onnx)
+if os.environ.get("EXPORT_ONNX", "0") == "1":
+    from src.embeddings import OnnxEmbedder, export_onnx_model, verify_onnx_embedder
+
+    onnx_dir = os.environ.get("ONNX_MODEL_DIR", os.path.join(cache_dir, "onnx-all-MiniLM-L6-v2"))
+    print("📦 Exporting quantized ONNX model to", onnx_dir)
+    export_onnx_model(model, onnx_dir)
+    worst = verify_onnx_embedder(OnnxEmbedder(onnx_dir), model)
+    print(f"✅ ONNX model exported (min cosine vs PyTorch: {worst:.4f})")
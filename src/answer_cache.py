@@ -0,0 +1,100 @@
+# src/answer_cache.py
+import os
+from collections import OrderedDict
+from itertools import count
+from threading import Lock
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))  # 0 disables the cache
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+
+
+class SemanticAnswerCache:
+    """
+    Size-bounded LRU of (question embedding, partition) -> answer + sources.
+
+    A lookup hits when a cached question in the same partition (user_type,
+    top_k) has cosine similarity >= threshold with the new one. All entries
+    are dropped as soon as a different index version is seen, so answers
+    never outlive the index they were generated from.
+    """
+
+    def __init__(self, maxsize=ANSWER_CACHE_SIZE, threshold=ANSWER_CACHE_THRESHOLD):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # entry id -> (partition, unit vector, answer, source_documents)
+        self._matrices = {}  # partition -> (entry ids, stacked unit vectors), rebuilt lazily
+        self._ids = count()
+        self._lock = Lock()
+
+    @staticmethod
+    def _unit(vec):
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _check_version(self, index_version):
+        if index_version != self.index_version:
+            self._entries.clear()
+            self._matrices.clear()
+            self.index_version = index_version
+
+    def _matrix(self, partition):
+        if partition not in self._matrices:
+            ids = [eid for eid, entry in self._entries.items() if entry[0] == partition]
+            vecs = np.vstack([self._entries[eid][1] for eid in ids]) if ids else None
+            self._matrices[partition] = (ids, vecs)
+        return self._matrices[partition]
+
+    def lookup(self, embedding, partition, index_version):
+        """Returns (answer, source_documents) for a close-enough cached question, else None."""
+        if self.maxsize <= 0:
+            return None
+        query = self._unit(embedding)
+        with self._lock:
+            self._check_version(index_version)
+            ids, vecs = self._matrix(partition)
+            if vecs is not None:
+                sims = vecs @ query
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    eid = ids[best]
+                    self._entries.move_to_end(eid)
+                    self.hits += 1
+                    _, _, answer, sources = self._entries[eid]
+                    return answer, sources
+            self.misses += 1
+            return None
+
+    def store(self, embedding, partition, index_version, answer, source_documents):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._check_version(index_version)
+            self._entries[next(self._ids)] = (partition, self._unit(embedding), answer, list(source_documents))
+            self._matrices.pop(partition, None)
+            while len(self._entries) > self.maxsize:
+                _, (evicted_partition, _, _, _) = self._entries.popitem(last=False)
+                self._matrices.pop(evicted_partition, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -276,40 +276,57 @@
 
 
 import os
-import sqlite3
+
+# Robust imports (startup is stdlib-only, so importing it costs nothing)
+try:
+    import startup
+    from ticket_store import get_ticket_store
+except Exception:
+    from src import startup
+    from src.ticket_store import get_ticket_store
+
+# streamlit itself is already imported by `streamlit run` before this script executes,
+# so it is not in the startup report
 import streamlit as st
-from datetime import datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Robust imports
-try:
-    from generator import generate_answer
-    from retriever import load_retriever
-    from src.ingest import create_chroma_index
-except Exception:
-    # fallback if running from repo root (local)
-    from generator import generate_answer
-    from retriever import load_retriever
-    from ingest import create_chroma_index
-
 # --------------------------
-# Startup: preload retriever (Chroma + embeddings)
+# Streamlit page config (must be the first Streamlit call)
 # --------------------------
-REPO_ROOT = os.environ.get("RENDER_REPO_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-MODEL_CACHE = os.path.join(REPO_ROOT, "models")
-INDICES_PATH = os.path.join(REPO_ROOT, "indices")
+st.set_page_config(
+    page_title="RAG Chatbot",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
 
-st.write("⏳ Startup: loading retriever (Chroma + embeddings)...")
-try:
-    # This will raise a FileNotFoundError if indices are missing — we catch and show friendly message below
-    load_retriever()
-    st.write("✅ Retriever loaded.")
-except FileNotFoundError as e:
-    st.error(f"❌ Indices not found: {e}. Run ingest.py to create the indices (or set INDICES_DIR).")
-except Exception as e:
-    st.error(f"⚠️ Error loading retriever: {e}")
+# --------------------------
+# Startup: heavy imports (chromadb, sentence-transformers/torch, cohere) and the
+# retriever load happen once per process on a background thread, so the page
+# renders right away. Streamlit reruns this script, but cache_resource keeps
+# the single Warmup (and the pipeline it holds) for the whole process.
+# --------------------------
+@st.cache_resource(show_spinner=False)
+def get_warmup():
+    return startup.Warmup()
+
+warmup = get_warmup()
+if warmup.ready and warmup.error is not None:
+    # this run still reports the failure; the next rerun starts a fresh warm-up, so the
+    # app recovers once the indices exist (or a transient load error has passed)
+    get_warmup.clear()
+
+def get_pipeline():
+    """The generator module, once warm-up is done (waits for it if needed)."""
+    try:
+        if not warmup.ready:
+            with st.spinner("⏳ Loading knowledge base (Chroma + embeddings)..."):
+                return warmup.wait()
+        return warmup.wait()
+    except Exception:
+        get_warmup.clear()  # retried on the next question
+        raise
 
 # --------------------------
 # Data directories & DB
@@ -317,75 +334,19 @@ except Exception as e:
 DATA_DIR = os.getenv("DATA_DIR", "./data")
 os.makedirs(DATA_DIR, exist_ok=True)
 
-DB_PATH = os.getenv("TICKETS_DB_PATH", "./tickets.db")
-
-def init_tickets_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tickets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user TEXT NOT NULL,
-            platform TEXT NOT NULL,
-            issue TEXT NOT NULL,
-            answer_provided TEXT,
-            timestamp TEXT NOT NULL,
-            status TEXT DEFAULT 'open'
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def save_ticket(user, platform, issue, answer_provided):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute('''
-        INSERT INTO tickets (user, platform, issue, answer_provided, timestamp)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user, platform, issue, answer_provided, timestamp))
-    conn.commit()
-    ticket_id = cursor.lastrowid
-    conn.close()
-    return ticket_id
-
-def get_all_tickets():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, user, platform, issue, answer_provided, timestamp, status
-        FROM tickets
-        ORDER BY id DESC
-    ''')
-    tickets = cursor.fetchall()
-    conn.close()
-    return tickets
-
-def get_ticket_count():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM tickets WHERE status = 'open'")
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
-
-# Initialize database
-init_tickets_db()
+# ticket store: per-thread connections, WAL, indexed status/timestamp, trigger-maintained open count
+tickets_db = get_ticket_store()
 
-# --------------------------
-# Streamlit page config
-# --------------------------
-st.set_page_config(
-    page_title="RAG Chatbot",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
 
 # Initialize session state
 if "history" not in st.session_state:
     st.session_state.history = []
 if "tickets" not in st.session_state:
     st.session_state.tickets = []
+if "ticket_cursors" not in st.session_state:
+    # before_id of each page visited in the ticket browser; the last one is shown
+    st.session_state.ticket_cursors = [None]
+    st.session_state.ticket_filters = ("All", "All")
 
 # --------------------------
 # Custom CSS
@@ -459,25 +420,67 @@ with st.sidebar:
     st.divider()
     
     st.subheader("Support Tickets")
-    ticket_count = get_ticket_count()
+    ticket_count = tickets_db.get_ticket_count()
     if ticket_count > 0:
         st.metric("Open Tickets", ticket_count)
-        with st.expander("View Tickets"):
-            tickets = get_all_tickets()
-            for ticket in tickets:
-                ticket_id, user, platform, issue, answer, timestamp, status = ticket
-                st.markdown(f"**Ticket #{ticket_id}** - `{status}`")
-                st.text(f"User: {user}")
-                st.text(f"Platform: {platform}")
-                st.text(f"Issue: {issue}")
-                if answer:
-                    with st.expander("View Answer Provided"):
-                        st.text(answer)
-                st.caption(f"Created: {timestamp}")
-                if ticket != tickets[-1]:
-                    st.markdown("---")
     else:
-        st.info("No tickets raised")
+        st.info("No open tickets")
+
+    # only the visible page is queried (keyset pagination by id); nothing is fetched until opened
+    if st.toggle("View Tickets", key="show_tickets"):
+        status_filter = st.selectbox("Status", ["All", "open", "closed"], key="ticket_status_filter")
+        platform_filter = st.selectbox("Platform", ["All", "Windows", "Linux", "Zimbra"], key="ticket_platform_filter")
+        filters = (status_filter, platform_filter)
+        if st.session_state.ticket_filters != filters:
+            st.session_state.ticket_filters = filters
+            st.session_state.ticket_cursors = [None]
+        cursors = st.session_state.ticket_cursors
+        tickets, next_cursor = tickets_db.get_tickets_page(
+            before_id=cursors[-1],
+            status=None if status_filter == "All" else status_filter,
+            platform=None if platform_filter == "All" else platform_filter,
+        )
+        if not tickets:
+            st.info("No tickets raised" if filters == ("All", "All") else "No matching tickets")
+        for i, (ticket_id, user, platform, issue, answer, timestamp, status) in enumerate(tickets):
+            if i:
+                st.markdown("---")
+            st.markdown(f"**Ticket #{ticket_id}** - `{status}`")
+            st.text(f"User: {user}")
+            st.text(f"Platform: {platform}")
+            st.text(f"Issue: {issue}")
+            if answer:
+                with st.expander("View Answer Provided"):
+                    st.text(answer)
+            st.caption(f"Created: {timestamp}")
+
+        col_prev, col_page, col_next = st.columns([1, 1, 1])
+        with col_prev:
+            if st.button("◀ Newer", disabled=len(cursors) == 1, use_container_width=True):
+                cursors.pop()
+                st.rerun()
+        with col_page:
+            st.caption(f"Page {len(cursors)}")
+        with col_next:
+            if st.button("Older ▶", disabled=next_cursor is None, use_container_width=True):
+                cursors.append(next_cursor)
+                st.rerun()
+
+    st.divider()
+
+    st.subheader("Startup")
+    if not warmup.ready:
+        st.caption("⏳ Loading knowledge base in the background...")
+    elif warmup.error is not None:
+        if isinstance(warmup.error, FileNotFoundError):
+            st.error(f"❌ Indices not found: {warmup.error}. Run ingest.py to create the indices (or set INDICES_DIR).")
+        else:
+            st.error(f"⚠️ Error loading retriever: {warmup.error}")
+    else:
+        st.caption("✅ Retriever loaded.")
+    with st.expander("Startup report"):
+        for stage, seconds in startup.startup_report():
+            st.text(f"{stage:<32} {seconds * 1000:>9.1f} ms")
 
 # --------------------------
 # Main Chat Interface
@@ -496,20 +499,23 @@ with col1:
     ask = st.button("Ask", use_container_width=True, type="primary")
 
 if ask and query:
-    with st.spinner("Searching knowledge base..."):
-        try:
-            out = generate_answer(query, user_type=user_type)
-            answer = out.get("answer", "").strip()
-            st.session_state.history.insert(0, {
-                "question": query,
-                "answer": answer,
-                "user_type": user_type,
-                "feedback": None,
-                "ticket_raised": False
-            })
-            st.rerun()
-        except Exception as e:
-            st.error(f"❌ Error: {e}")
+    try:
+        pipeline = get_pipeline()
+        with st.spinner("Searching knowledge base..."):
+            out = pipeline.generate_answer_stream(query, user_type=user_type)
+        # render tokens as they arrive; write_stream returns the full text
+        answer = st.write_stream(out["answer_stream"])
+        answer = (answer if isinstance(answer, str) else "".join(map(str, answer))).strip()
+        st.session_state.history.insert(0, {
+            "question": query,
+            "answer": answer,
+            "user_type": user_type,
+            "feedback": None,
+            "ticket_raised": False
+        })
+        st.rerun()
+    except Exception as e:
+        st.error(f"❌ Error: {e}")
 
 # --------------------------
 # Display chat history
@@ -545,7 +551,7 @@ else:
                 
                 with col_no:
                     if st.button("❌ No, Raise Ticket", key=f"ticket_{idx}"):
-                        ticket_id = save_ticket(
+                        ticket_id = tickets_db.save_ticket(
                             user="Guest",
                             platform=ut,
                             issue=q,
@@ -0,0 +1,129 @@
+# src/batching.py
+import os
+import time
+from collections import deque
+from threading import Condition, Event, Thread
+
+# how long a batch of concurrent requests may wait for more to join (0 disables micro-batching);
+# a lone request on an idle batcher is encoded at once
+QUERY_BATCH_WAIT_MS = float(os.environ.get("QUERY_BATCH_WAIT_MS", "5"))
+# most texts encoded in one batch; a single larger request still forms its own batch
+QUERY_BATCH_MAX_SIZE = int(os.environ.get("QUERY_BATCH_MAX_SIZE", "32"))
+
+class _Request:
+    __slots__ = ("texts", "enqueued", "done", "result", "error")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.enqueued = time.monotonic()
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+class MicroBatchEncoder:
+    """
+    Coalesces concurrent encode() calls into batched calls on the wrapped model.
+
+    A background thread takes the oldest request and everything queued behind
+    it, encodes up to `max_batch_size` texts in one call and hands each caller
+    its rows. A lone request is dispatched at once; only when others are
+    already queued (a burst) does it wait up to `max_wait_ms`, measured from
+    when the oldest was queued, for more to arrive. Requests arriving while a
+    batch is encoding queue up and form the next batch.
+    Only this thread calls into the model, so concurrent callers never run
+    the model at the same time. Exposes the same encode() subset as the models.
+    """
+
+    def __init__(self, model, max_wait_ms=QUERY_BATCH_WAIT_MS, max_batch_size=QUERY_BATCH_MAX_SIZE):
+        self.model = model
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue = deque()
+        self._cond = Condition()
+        self._thread = None
+        # metrics, guarded by _cond
+        self._queued_texts = 0
+        self._max_queued_texts = 0
+        self._batches = 0
+        self._texts = 0
+        self._requests = 0
+        self._wait_total = 0.0
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+        req = _Request(texts)
+        with self._cond:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="embed-batcher", daemon=True)
+                self._thread.start()
+            self._queue.append(req)
+            self._queued_texts += len(texts)
+            self._max_queued_texts = max(self._max_queued_texts, self._queued_texts)
+            self._cond.notify()
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result[0] if single else req.result
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            batch = [self._queue.popleft()]
+            size = len(batch[0].texts)
+            deadline = batch[0].enqueued + self.max_wait
+            while size < self.max_batch_size:
+                if self._queue:
+                    if size + len(self._queue[0].texts) > self.max_batch_size:
+                        break
+                    req = self._queue.popleft()
+                    batch.append(req)
+                    size += len(req.texts)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or len(batch) == 1:
+                    # nothing else was waiting: an idle batcher doesn't delay a single request
+                    break
+                self._cond.wait(remaining)
+            now = time.monotonic()
+            self._queued_texts -= size
+            self._batches += 1
+            self._texts += size
+            self._requests += len(batch)
+            self._wait_total += sum(now - req.enqueued for req in batch)
+            return batch, size
+
+    def _run(self):
+        while True:
+            batch, size = self._next_batch()
+            texts = [text for req in batch for text in req.texts]
+            try:
+                vectors = self.model.encode(texts, batch_size=max(size, 1), convert_to_numpy=True,
+                                            show_progress_bar=False)
+            except Exception as e:
+                for req in batch:
+                    req.error = e
+                    req.done.set()
+                continue
+            offset = 0
+            for req in batch:
+                req.result = vectors[offset:offset + len(req.texts)]
+                offset += len(req.texts)
+                req.done.set()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": self._queued_texts,
+                "queued_requests": len(self._queue),
+                "max_queue_depth": self._max_queued_texts,
+                "batches": self._batches,
+                "texts": self._texts,
+                "avg_batch_size": self._texts / self._batches if self._batches else 0.0,
+                "avg_wait_ms": 1000.0 * self._wait_total / self._requests if self._requests else 0.0,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "max_batch_size": self.max_batch_size,
+            }
@@ -0,0 +1,128 @@
+# src/compression.py
+import os
+import re
+import json
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# optional stage between retrieval and context packing (off by default)
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "0") == "1"
+COMPRESSION_MIN_SCORE = float(os.getenv("COMPRESSION_MIN_SCORE", "0.25"))  # cosine similarity to the query
+COMPRESSION_MIN_UNITS = int(os.getenv("COMPRESSION_MIN_UNITS", "1"))  # best units kept per doc regardless of score
+COMPRESSION_MAX_UNITS = int(os.getenv("COMPRESSION_MAX_UNITS", "6"))  # most scored units kept per doc
+# FAQ record fields always kept whole (the question the record answers); the resolution, most
+# of a record, is scored sentence by sentence like any other long field
+COMPRESSION_KEEP_FIELDS = frozenset(
+    f.strip() for f in os.getenv("COMPRESSION_KEEP_FIELDS", "Issue").split(",") if f.strip()
+)
+# record fields longer than this are scored sentence by sentence instead of as a whole
+COMPRESSION_SPLIT_CHARS = int(os.getenv("COMPRESSION_SPLIT_CHARS", "400"))
+UNIT_CACHE_SIZE = int(os.getenv("COMPRESSION_CACHE_SIZE", "4096"))
+
+_sentence_pattern = re.compile(r"(?<=[.!?])\s+|\n+")
+
+def split_sentences(text: str):
+    return [s.strip() for s in _sentence_pattern.split(text or "") if s and s.strip()]
+
+def _units(content: str):
+    """
+    Scoring units of a chunk as (field, text): the fields of a JSON FAQ record
+    (long ones split into sentences), or the sentences of plain text (field None).
+    Returns (units, is_record); COMPRESSION_KEEP_FIELDS are single, unscored units.
+    """
+    try:
+        record = json.loads(content)
+    except (ValueError, TypeError):
+        record = None
+    if not isinstance(record, dict):
+        return [(None, s) for s in split_sentences(content)], False
+    units = []
+    for field, value in record.items():
+        if not isinstance(value, str) or not value.strip():
+            continue
+        if len(value) > COMPRESSION_SPLIT_CHARS and field not in COMPRESSION_KEEP_FIELDS:
+            units.extend((field, s) for s in split_sentences(value))
+        else:
+            units.append((field, value.strip()))
+    return units, True
+
+def _rebuild(units, is_record):
+    if not is_record:
+        return " ".join(text for _, text in units)
+    record = {}
+    for field, text in units:
+        record[field] = f"{record[field]} {text}" if field in record else text
+    return json.dumps(record, ensure_ascii=False)
+
+class UnitEmbeddingCache:
+    """Thread-safe LRU of unit text -> unit-normalized embedding (retrieved chunks repeat across queries)."""
+
+    def __init__(self, maxsize=UNIT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def embed(self, texts, embed_model):
+        """(len(texts), dim) matrix; only uncached texts are encoded, in one batched call."""
+        with self._lock:
+            vecs = [self._data.get(t) for t in texts]
+            for t, v in zip(texts, vecs):
+                if v is not None:
+                    self._data.move_to_end(t)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vecs) if v is None))
+        if missing:
+            enc = np.asarray(embed_model.encode(missing, convert_to_numpy=True, show_progress_bar=False), dtype=np.float32)
+            enc = enc / np.clip(np.linalg.norm(enc, axis=1, keepdims=True), 1e-12, None)
+            fresh = dict(zip(missing, enc))
+            vecs = [v if v is not None else fresh[t] for t, v in zip(texts, vecs)]
+            if self.maxsize > 0:
+                with self._lock:
+                    self._data.update(fresh)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+        return np.vstack(vecs)
+
+_unit_cache = UnitEmbeddingCache()
+
+def compress_docs(query_emb, docs, embed_model, min_score=COMPRESSION_MIN_SCORE,
+                  min_units=COMPRESSION_MIN_UNITS, max_units=COMPRESSION_MAX_UNITS):
+    """
+    Keep only the fields/sentences of each doc that match the query.
+
+    Every scored unit of every doc is embedded (cache misses in one encode
+    call) and scored against the query with a single matrix-vector product.
+    Per doc the `min_units` best units are kept, plus any others scoring >=
+    min_score, up to `max_units`, in their original order; pinned record
+    fields (COMPRESSION_KEEP_FIELDS) are always kept. Returned docs keep their
+    id and metadata (so sources are still attributed) with a shorter page_content.
+    """
+    per_doc = []
+    for d in docs:
+        units, is_record = _units(d["page_content"])
+        scored = [i for i, (field, _) in enumerate(units) if field not in COMPRESSION_KEEP_FIELDS]
+        per_doc.append((units, is_record, scored))
+    texts = [units[i][1] for units, _, scored in per_doc for i in scored]
+    if not texts:
+        return docs
+
+    q = np.asarray(query_emb, dtype=np.float32)
+    q = q / max(float(np.linalg.norm(q)), 1e-12)
+    scores = _unit_cache.embed(texts, embed_model) @ q
+
+    out, offset = [], 0
+    for d, (units, is_record, scored) in zip(docs, per_doc):
+        s = scores[offset:offset + len(scored)]
+        offset += len(scored)
+        if len(scored) <= min_units:
+            out.append(d)
+            continue
+        order = np.argsort(-s)
+        keep = {scored[i] for i in order[:min_units]}
+        keep.update(scored[i] for i in order[min_units:max_units] if s[i] >= min_score)
+        kept = [unit for i, unit in enumerate(units) if i in keep or unit[0] in COMPRESSION_KEEP_FIELDS]
+        out.append({**d, "page_content": _rebuild(kept, is_record)})
+    return out
@@ -0,0 +1,170 @@
+# src/context_packer.py
+import os
+import re
+import logging
+from functools import lru_cache
+from threading import Lock
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.environ.get("RENDER_REPO_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", os.path.join(REPO_ROOT, "models"))
+# tokenizer of the chat model, so budgets are in the tokens Cohere bills and processes;
+# fetched by download.py into CONTEXT_TOKENIZER_PATH; never downloaded at runtime (without the
+# file, token counts fall back to a word-based estimate)
+CONTEXT_TOKENIZER = os.environ.get("CONTEXT_TOKENIZER", "Xenova/c4ai-command-r-v01-tokenizer")
+CONTEXT_TOKENIZER_PATH = os.environ.get("CONTEXT_TOKENIZER_PATH", os.path.join(CACHE_DIR, "context_tokenizer.json"))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1024"))  # tokens for all sources together
+# a doc that does not fit whole is cut to the remaining budget only if at least this much is left
+CONTEXT_MIN_PARTIAL_TOKENS = int(os.environ.get("CONTEXT_MIN_PARTIAL_TOKENS", "64"))
+# longest duplicated run looked for between two chunks (ingest.py splits with chunk_overlap=200)
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 20
+
+_tokenizer = None
+_lock = Lock()
+_approx_pattern = re.compile(r"\w+|[^\w\s]")
+_boundary_pattern = re.compile(r"[.!?\n]\s")
+
+class _ApproxTokenizer:
+    """Word/punctuation split, used when the chat model's tokenizer can't be loaded."""
+
+    def offsets(self, text):
+        return [m.span() for m in _approx_pattern.finditer(text)]
+
+class _HFTokenizer:
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def offsets(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False).offsets
+
+def download_tokenizer():
+    """Fetch CONTEXT_TOKENIZER from the Hub into CONTEXT_TOKENIZER_PATH (run by download.py, never per request)."""
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_pretrained(CONTEXT_TOKENIZER)
+    os.makedirs(os.path.dirname(CONTEXT_TOKENIZER_PATH), exist_ok=True)
+    tokenizer.save(CONTEXT_TOKENIZER_PATH)
+    return tokenizer
+
+def get_tokenizer():
+    """Process-wide tokenizer used for context budgets (loaded once, from the local file only)."""
+    global _tokenizer
+    if _tokenizer is not None:
+        return _tokenizer
+    with _lock:
+        if _tokenizer is None:
+            if not os.path.exists(CONTEXT_TOKENIZER_PATH):
+                logger.warning("Context tokenizer not found at %s; estimating tokens from words "
+                               "(run download.py to fetch %s)", CONTEXT_TOKENIZER_PATH, CONTEXT_TOKENIZER)
+                _tokenizer = _ApproxTokenizer()
+                return _tokenizer
+            try:
+                from tokenizers import Tokenizer
+
+                _tokenizer = _HFTokenizer(Tokenizer.from_file(CONTEXT_TOKENIZER_PATH))
+            except Exception as e:
+                logger.warning("Context tokenizer %s unavailable (%s); estimating tokens from words", CONTEXT_TOKENIZER_PATH, e)
+                _tokenizer = _ApproxTokenizer()
+    return _tokenizer
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Token count of `text`; memoized, since the same chunks come back for many queries."""
+    return len(get_tokenizer().offsets(text))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of `text` within max_tokens, cut back to a sentence/line end when there is one."""
+    offsets = get_tokenizer().offsets(text)
+    if len(offsets) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    cut = text[:offsets[max_tokens - 1][1]]
+    ends = [m.start() + 1 for m in _boundary_pattern.finditer(cut)]
+    if ends and ends[-1] > len(cut) // 2:
+        cut = cut[:ends[-1]]
+    return cut.rstrip()
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is also a prefix of `b` (0 below MIN_OVERLAP_CHARS)."""
+    tail = a[-MAX_OVERLAP_CHARS:]
+    probe = b[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = tail.find(probe)
+    while start != -1:
+        if b.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(probe, start + 1)
+    return 0
+
+def strip_overlap(text: str, kept) -> str:
+    """
+    Drop text already present in `kept`: exact/contained duplicates become "",
+    and a boundary shared with a neighbouring chunk (chunk_overlap) is cut off.
+    """
+    for other in kept:
+        if text in other:
+            return ""
+        n = _overlap(other, text)
+        if n:
+            text = text[n:].lstrip()
+        n = _overlap(text, other)
+        if n:
+            text = text[:-n].rstrip()
+    return text
+
+def _doc_content(d):
+    # Support LangChain Document or dict-like
+    return getattr(d, "page_content", None) or (d.get("page_content") if isinstance(d, dict) else str(d))
+
+class PackedContext:
+    """Result of pack_context: prompt text, the docs it cites (in [SOURCE n] order) and token accounting."""
+
+    __slots__ = ("text", "docs", "tokens", "original_tokens")
+
+    def __init__(self, text, docs, tokens, original_tokens):
+        self.text = text
+        self.docs = docs
+        self.tokens = tokens
+        self.original_tokens = original_tokens
+
+    @property
+    def saved_tokens(self):
+        return max(0, self.original_tokens - self.tokens)
+
+def pack_context(docs, budget_tokens: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Fill up to `budget_tokens` with the docs, most relevant (first) first.
+
+    Text repeated from an already packed chunk is removed, a doc that doesn't
+    fit whole is cut to the remaining budget (if enough is left) and later,
+    smaller docs may still fill the rest. original_tokens is what sending
+    every doc in full would have cost.
+    """
+    parts, packed_docs, kept = [], [], []
+    used = original = 0
+    for d in docs:
+        content = (_doc_content(d) or "").strip()
+        original += count_tokens(content)
+        snippet = strip_overlap(content, kept)
+        if not snippet:
+            continue
+        header = ("\n\n" if parts else "") + f"[SOURCE {len(packed_docs) + 1}]\n"
+        cost = count_tokens(header) + count_tokens(snippet)
+        remaining = budget_tokens - used
+        if cost > remaining:
+            room = remaining - count_tokens(header)
+            if room < CONTEXT_MIN_PARTIAL_TOKENS:
+                continue
+            snippet = truncate_to_tokens(snippet, room - 3) + " ..."  # room for the ellipsis
+            cost = count_tokens(header) + count_tokens(snippet)
+        kept.append(content)
+        packed_docs.append(d)
+        parts.append(header + snippet)
+        used += cost
+    return PackedContext("".join(parts), packed_docs, used, original)
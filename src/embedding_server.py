@@ -0,0 +1,126 @@
+# src/embedding_server.py
+# Hosts one embedding model for every Streamlit worker / ingest run on the box.
+# Clients (embeddings.RemoteEmbedder, picked up by load_embedding_model) connect
+# over a Unix socket or localhost TCP; when no server is running they load the
+# model themselves.
+#
+#   python -m src.embedding_server [--address PATH|HOST:PORT]
+import os
+import socket
+import argparse
+import logging
+import socketserver
+import numpy as np
+
+try:
+    from src.embeddings import (
+        EMBEDDING_SERVER, embedding_model_id, load_embedding_model, parse_server_address,
+        recv_message, send_message,
+    )
+    from src.batching import MicroBatchEncoder
+except Exception:
+    from embeddings import (
+        EMBEDDING_SERVER, embedding_model_id, load_embedding_model, parse_server_address,
+        recv_message, send_message,
+    )
+    from batching import MicroBatchEncoder
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """Serves requests on one client connection until the client disconnects."""
+
+    def handle(self):
+        while True:
+            try:
+                header, _ = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                reply, payload = self.server.dispatch(header)
+            except Exception as e:
+                logger.exception("Embedding request failed")
+                reply, payload = {"error": str(e)}, b""
+            try:
+                send_message(self.request, reply, payload)
+            except OSError:
+                return
+
+class _ServerMixin:
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128  # every Streamlit session thread may connect at once
+
+    def setup_model(self):
+        # requests from all client processes are coalesced; only the batcher thread runs the model
+        self.model = MicroBatchEncoder(load_embedding_model(use_server=False))
+        self.model_id = embedding_model_id()
+
+    def dispatch(self, header):
+        op = header.get("op")
+        if op == "info":
+            return {"model": self.model_id, "pid": os.getpid(), "batcher": self.model.stats()}, b""
+        if op == "encode":
+            texts = header.get("texts") or []
+            vectors = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+            vectors = np.ascontiguousarray(vectors, dtype="<f4")
+            return {"shape": list(vectors.shape)}, vectors.tobytes()
+        raise ValueError(f"unknown op {op!r}")
+
+class UnixEmbeddingServer(_ServerMixin, socketserver.ThreadingUnixStreamServer):
+    pass
+
+class TCPEmbeddingServer(_ServerMixin, socketserver.ThreadingTCPServer):
+    pass
+
+def _claim_socket_path(path):
+    """Remove a stale socket file, refusing if a live server is still listening on it."""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+    else:
+        raise RuntimeError(f"An embedding server is already listening on {path}")
+    finally:
+        probe.close()
+
+def make_server(address=EMBEDDING_SERVER):
+    family, addr = parse_server_address(address)
+    if family == socket.AF_UNIX:
+        _claim_socket_path(addr)
+        server = UnixEmbeddingServer(addr, EmbeddingRequestHandler, bind_and_activate=False)
+    else:
+        server = TCPEmbeddingServer(addr, EmbeddingRequestHandler, bind_and_activate=False)
+    # load the model before accepting connections, so clients never wait on a cold server
+    server.setup_model()
+    try:
+        server.server_bind()
+        server.server_activate()
+    except OSError:
+        server.server_close()
+        raise
+    return server
+
+def serve(address=EMBEDDING_SERVER):
+    server = make_server(address)
+    print(f"🧠 Embedding server ({server.model_id}) listening on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if parse_server_address(address)[0] == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve sentence embeddings to local processes.")
+    parser.add_argument("--address", default=EMBEDDING_SERVER,
+                        help="Unix socket path or host:port (default: EMBEDDING_SERVER)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve(args.address)
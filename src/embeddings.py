@@ -0,0 +1,308 @@
+# src/embeddings.py
+import os
+import json
+import time
+import socket
+import struct
+import logging
+import threading
+from threading import Lock
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.environ.get("RENDER_REPO_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", os.path.join(REPO_ROOT, "models"))
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# "torch" (SentenceTransformer) or "onnx" (int8-quantized export written by download.py)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch").lower()
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", os.path.join(CACHE_DIR, "onnx-all-MiniLM-L6-v2"))
+ONNX_MODEL_FILE = "model.int8.onnx"
+# minimum cosine similarity between ONNX and PyTorch vectors accepted by verify_onnx_embedder
+ONNX_MIN_COSINE = float(os.environ.get("ONNX_MIN_COSINE", "0.99"))
+MAX_SEQ_LENGTH = 256  # same truncation as the sentence-transformers config for this model
+EMBED_DIM = 384
+# shared embedding server (src/embedding_server.py): a Unix socket path or "host:port"; "off" disables.
+# When nothing is listening there, every process falls back to loading its own model.
+EMBEDDING_SERVER = os.environ.get("EMBEDDING_SERVER", os.path.join(CACHE_DIR, "embedding_server.sock"))
+EMBEDDING_SERVER_TIMEOUT = float(os.environ.get("EMBEDDING_SERVER_TIMEOUT", "30"))  # seconds per request
+# after the server fails, encode in-process for this long before trying it again
+EMBEDDING_SERVER_RETRY = float(os.environ.get("EMBEDDING_SERVER_RETRY", "30"))
+
+_model = None
+_lock = Lock()
+
+class OnnxEmbedder:
+    """
+    MiniLM sentence embeddings from a quantized ONNX graph: tokenizers +
+    onnxruntime + mean pooling + L2 normalization, i.e. the same pipeline as
+    the SentenceTransformer, without importing torch.
+
+    Exposes the subset of SentenceTransformer.encode used in this repo.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+        # mean pooling over real tokens, then L2 normalize
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, EMBED_DIM), dtype=np.float32)
+        out = np.vstack([self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+        out = out.astype(np.float32)
+        return out[0] if single else out
+
+def embedding_model_id(backend=None):
+    """Identifies the model + backend, e.g. for keying cached vectors."""
+    backend = backend or EMBEDDING_BACKEND
+    return EMBED_MODEL_NAME if backend == "torch" else f"{EMBED_MODEL_NAME}:onnx-int8"
+
+def _load_torch_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBED_MODEL_NAME, cache_folder=CACHE_DIR)
+
+def _load_local_model():
+    if EMBEDDING_BACKEND == "onnx":
+        if not os.path.exists(os.path.join(ONNX_MODEL_DIR, ONNX_MODEL_FILE)):
+            raise FileNotFoundError(
+                f"No ONNX model found at {ONNX_MODEL_DIR}. Run `EXPORT_ONNX=1 python download.py` first."
+            )
+        return OnnxEmbedder(ONNX_MODEL_DIR)
+    # Load the small sentence-transformers model from the cache folder (downloaded by download.py)
+    return _load_torch_model()
+
+def load_embedding_model(use_server=True):
+    """
+    Process-wide embedding model for the configured EMBEDDING_BACKEND (loaded once).
+
+    If an embedding server with the same model is listening on EMBEDDING_SERVER,
+    a RemoteEmbedder is returned instead so this process never loads the model.
+    """
+    global _model
+    if _model is not None:
+        return _model
+    with _lock:
+        if _model is None:
+            remote = connect_embedding_server() if use_server else None
+            _model = remote if remote is not None else _load_local_model()
+    return _model
+
+# ------------------------------
+# Shared embedding server client (server side: src/embedding_server.py)
+# ------------------------------
+# Each message is a fixed header with the sizes of a JSON part and a binary
+# part, followed by both. Vectors travel as raw little-endian float32.
+_FRAME = struct.Struct("!II")
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+def parse_server_address(address):
+    """(socket family, address) for a Unix socket path or a "host:port" string."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        read = sock.recv_into(view[got:])
+        if not read:
+            raise ConnectionError("embedding server connection closed")
+        got += read
+    return buf
+
+def send_message(sock, header, payload=b""):
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_FRAME.pack(len(data), len(payload)) + data + bytes(payload))
+
+def recv_message(sock):
+    """Returns (header dict, payload bytearray)."""
+    header_len, payload_len = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    if header_len + payload_len > MAX_MESSAGE_BYTES:
+        raise ConnectionError(f"embedding server message too large ({header_len + payload_len} bytes)")
+    header = json.loads(_recv_exact(sock, header_len).decode("utf-8"))
+    return header, _recv_exact(sock, payload_len)
+
+class RemoteEmbedder:
+    """
+    Client for the shared embedding server, with the same encode() subset as
+    OnnxEmbedder. Connections are kept per thread. If the server goes away,
+    encoding falls back to an in-process model until EMBEDDING_SERVER_RETRY
+    seconds have passed.
+    """
+
+    def __init__(self, address=EMBEDDING_SERVER, timeout=EMBEDDING_SERVER_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+        self._fallback = None
+        self._fallback_lock = Lock()
+        self._retry_at = 0.0
+
+    def _connect(self):
+        family, addr = parse_server_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(addr)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def request(self, header, payload=b""):
+        # one retry on a fresh connection, in case the server restarted since the last call
+        for attempt in (0, 1):
+            sock = getattr(self._local, "sock", None)
+            fresh = sock is None
+            try:
+                if fresh:
+                    sock = self._local.sock = self._connect()
+                send_message(sock, header, payload)
+                reply, data = recv_message(sock)
+            except OSError:
+                self._close()
+                if fresh or attempt:
+                    raise
+                continue
+            if "error" in reply:
+                raise RuntimeError(f"Embedding server error: {reply['error']}")
+            return reply, data
+
+    def info(self):
+        return self.request({"op": "info"})[0]
+
+    def _local_model(self):
+        with self._fallback_lock:
+            if self._fallback is None:
+                logger.warning("Embedding server at %s unavailable; loading the model in-process", self.address)
+                self._fallback = _load_local_model()
+            return self._fallback
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, EMBED_DIM), dtype=np.float32)
+        if time.monotonic() >= self._retry_at:
+            try:
+                reply, data = self.request({"op": "encode", "texts": texts, "batch_size": batch_size})
+                out = np.frombuffer(data, dtype="<f4").reshape(reply["shape"])
+                return out[0] if single else out
+            except OSError:
+                self._retry_at = time.monotonic() + EMBEDDING_SERVER_RETRY
+        out = self._local_model().encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+        out = np.asarray(out, dtype=np.float32)
+        return out[0] if single else out
+
+def connect_embedding_server(address=EMBEDDING_SERVER):
+    """A RemoteEmbedder if a server for this model answers at `address`, else None."""
+    if not address or address.lower() == "off":
+        return None
+    if parse_server_address(address)[0] == socket.AF_UNIX and not os.path.exists(address):
+        return None
+    remote = RemoteEmbedder(address, timeout=min(EMBEDDING_SERVER_TIMEOUT, 2.0))
+    try:
+        info = remote.info()
+    except (OSError, RuntimeError, ValueError):
+        logger.info("No embedding server at %s; encoding in-process", address)
+        return None
+    finally:
+        remote._close()
+    if info.get("model") != embedding_model_id():
+        # vectors from another model/backend would not match the index or the embedding cache
+        logger.warning("Embedding server at %s serves %s, expected %s; encoding in-process",
+                       address, info.get("model"), embedding_model_id())
+        return None
+    remote.timeout = EMBEDDING_SERVER_TIMEOUT
+    logger.info("Using embedding server at %s", address)
+    return remote
+
+# ------------------------------
+# ONNX export & verification (used by download.py)
+# ------------------------------
+VERIFY_SENTENCES = [
+    "How do I set up my email account?",
+    "What are the SMTP/IMAP/POP3 settings for my email account?",
+    "imap port",
+    "zimbra quota exceeded",
+    "Why are my emails going to the recipient's spam folder?",
+]
+
+def export_onnx_model(st_model, out_dir=ONNX_MODEL_DIR):
+    """Export the transformer inside a SentenceTransformer to ONNX and quantize its weights to int8."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(out_dir, exist_ok=True)
+    hf_model = st_model[0].auto_model
+    tokenizer = st_model.tokenizer
+    hf_model.config.return_dict = False
+    hf_model.eval()
+
+    sample = tokenizer(["hello world"], return_tensors="pt")
+    fp32_path = os.path.join(out_dir, "model.fp32.onnx")
+    dynamic = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            hf_model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic,
+                          "token_type_ids": dynamic, "last_hidden_state": dynamic},
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, os.path.join(out_dir, ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    tokenizer.save_pretrained(out_dir)  # writes tokenizer.json for the `tokenizers` library
+    return out_dir
+
+def verify_onnx_embedder(onnx_model, reference_model, sentences=VERIFY_SENTENCES, min_cosine=ONNX_MIN_COSINE):
+    """
+    Compare ONNX vectors against the PyTorch ones. Returns the lowest cosine
+    similarity seen and raises ValueError if it is below `min_cosine`.
+    """
+    ours = onnx_model.encode(sentences)
+    ref = reference_model.encode(sentences, convert_to_numpy=True, show_progress_bar=False)
+    ref = ref / np.linalg.norm(ref, axis=1, keepdims=True)
+    worst = float(np.min(np.sum(ours * ref, axis=1)))
+    if worst < min_cosine:
+        raise ValueError(f"ONNX embeddings drift from PyTorch: min cosine {worst:.4f} < {min_cosine}")
+    return worst
@@ -43,7 +43,11 @@
 import os
 import textwrap
 import re
+import asyncio
 import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -52,46 +56,78 @@ logger = logging.getLogger(__name__)
 # ------------------------------
 # Config from env
 # ------------------------------
-COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 TOP_K = int(os.getenv("RAG_TOP_K", "3"))
 MAX_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "256"))
 TEMPERATURE = float(os.getenv("GEN_TEMPERATURE", "0.0"))
-
-if not COHERE_API_KEY:
-    logger.error("COHERE_API_KEY not set in environment")
-    # we'll still let module import succeed; calls will error with helpful message
-
-# import Cohere ClientV2 lazily to avoid hard crash on import when env missing
-try:
-    import cohere
-    co = cohere.ClientV2(api_key=COHERE_API_KEY) if COHERE_API_KEY else None
-except Exception as e:
-    co = None
-    logger.warning("Cohere client not available: %s", e)
+# bump when the prompt templates below change, so cached responses are not reused; settings
+# that change the context (retrieval, packing, compression, relevance) are keyed separately,
+# see _context_settings()
+PROMPT_VERSION = "2"
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# low-confidence queries: "llm" asks the LLM for a clarifying question, "template" lists the
+# top candidates' issues without an LLM call
+CLARIFY_MODE = os.getenv("CLARIFY_MODE", "llm").lower()
 
 # Import retriever safely (support both src.* and top-level imports)
 try:
-    from src.retriever import get_retriever
+    from src.retriever import get_retriever, get_index_version, normalize_query
+    from src import retriever as retriever_module
 except Exception:
     try:
-        from retriever import get_retriever
+        from retriever import get_retriever, get_index_version, normalize_query
+        import retriever as retriever_module
     except Exception as e:
         get_retriever = None
+        get_index_version = None
+        retriever_module = None
         logger.warning("get_retriever import failed: %s", e)
 
+try:
+    from src.answer_cache import SemanticAnswerCache
+    from src.response_cache import ResponseCache, make_key
+    from src import metrics
+    from src.context_packer import CONTEXT_TOKEN_BUDGET, pack_context
+    from src.compression import COMPRESSION_ENABLED, compress_docs
+    from src.relevance import clarifying_answer, relevance_gate
+    from src import context_packer, compression, relevance
+    from src.resilience import CircuitOpenError
+    from src.llm_providers import get_llm_router
+except Exception:
+    from answer_cache import SemanticAnswerCache
+    from response_cache import ResponseCache, make_key
+    import metrics
+    from context_packer import CONTEXT_TOKEN_BUDGET, pack_context
+    from compression import COMPRESSION_ENABLED, compress_docs
+    from relevance import clarifying_answer, relevance_gate
+    import context_packer, compression, relevance
+    from resilience import CircuitOpenError
+    from llm_providers import get_llm_router
+
+# LLM providers (LLM_PROVIDERS) behind a latency-aware router; providers without a key or SDK
+# are skipped at import and calls return a helpful message, so module import still succeeds
+llm_router = get_llm_router()
+
+# Semantic answer cache: near-duplicate questions for the same user_type reuse the answer
+_answer_cache = SemanticAnswerCache()
+# Exact-match answer cache on disk, shared across processes and restarts
+_response_cache = ResponseCache()
+
+def answer_cache_stats():
+    return _answer_cache.stats()
+
+metrics.register_callback("rag_cache_hits_total", lambda: {(("cache", "semantic_answer"),): _answer_cache.hits},
+                          kind="counter")
+metrics.register_callback("rag_cache_misses_total", lambda: {(("cache", "semantic_answer"),): _answer_cache.misses},
+                          kind="counter")
+metrics.start_metrics_server()
+
 # ------------------------------
 # Utility helpers (copied/adapted)
 # ------------------------------
-def build_context_snippet(docs, max_chars_per_doc: int = 1000):
-    parts = []
-    for i, d in enumerate(docs, start=1):
-        # Support LangChain Document or dict-like
-        content = getattr(d, "page_content", None) or (d.get("page_content") if isinstance(d, dict) else str(d))
-        snippet = content.strip()
-        if len(snippet) > max_chars_per_doc:
-            snippet = snippet[:max_chars_per_doc] + " ..."
-        parts.append(f"[SOURCE {i}]\n{snippet}")
-    return "\n\n".join(parts)
+def build_context_snippet(docs, max_tokens: int = CONTEXT_TOKEN_BUDGET):
+    """[SOURCE n] blocks for the docs within a token budget (see context_packer.pack_context)."""
+    return pack_context(docs, max_tokens).text
 
 _token_pattern = re.compile(r"\w{3,}")
 
@@ -109,116 +145,417 @@ def is_context_relevant(question: str, context_text: str, threshold: float = 0.1
     return ratio >= threshold
 
 # ------------------------------
-# Cohere wrapper
+# LLM wrapper
 # ------------------------------
-def call_cohere_chat(prompt_text: str):
-    """
-    Calls Cohere Chat (ClientV2). Returns string or error message.
-    """
-    if co is None:
-        return "[Cohere client not configured — set COHERE_API_KEY in env]"
-
+_NOT_CONFIGURED = "[LLM client not configured — set COHERE_API_KEY (or MISTRAL_API_KEY with LLM_PROVIDERS) in env]"
+_ERROR_PREFIXES = ("[LLM client not configured", "[Error calling LLM API")
+
+def _is_error_text(text: str) -> bool:
+    return text.startswith(_ERROR_PREFIXES)
+
+def _provider_health(field):
+    def values():
+        return {(("provider", name),): h[field] for name, h in llm_router.health().items() if h[field] is not None}
+    return values
+
+metrics.register_callback(
+    "rag_llm_circuit_open",
+    lambda: {(("provider", name),): 0.0 if h["circuit"] == "closed" else 1.0
+             for name, h in llm_router.health().items()},
+    help_text="1 while the provider's circuit breaker is open or half-open",
+)
+metrics.register_callback("rag_llm_latency_p50_seconds", _provider_health("p50"),
+                          help_text="Rolling median LLM latency per provider (used for routing)")
+metrics.register_callback("rag_llm_error_rate", _provider_health("error_rate"),
+                          help_text="Rolling LLM error rate per provider (used for routing)")
+
+def _llm_error(reason: str):
+    metrics.inc("rag_llm_errors_total", reason=reason, help_text="Failed LLM calls")
+
+def _error_reason(e):
+    if isinstance(e, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(e, (TimeoutError, asyncio.TimeoutError)) or "timeout" in type(e).__name__.lower():
+        return "timeout"
+    return "api_error"
+
+def _record_llm_sizes(prompt_chars: int, response_chars: int):
+    metrics.observe("rag_prompt_chars", prompt_chars, buckets=metrics.SIZE_BUCKETS,
+                    help_text="Characters sent to the LLM per call")
+    metrics.observe("rag_response_chars", response_chars, buckets=metrics.SIZE_BUCKETS,
+                    help_text="Characters received from the LLM per call")
+    metrics.annotate(prompt_chars=prompt_chars, response_chars=response_chars)
+
+def _chat_messages(prompt_text: str):
     # Construct a combined system+user message similar to your local code
     content = (
         "SYSTEM: You are a helpful assistant. Use the context to answer concisely. "
         "Ask clarifying questions if needed.\n\n"
         f"USER: {prompt_text}"
     )
-    messages = [{"role": "user", "content": content}]
+    return [{"role": "user", "content": content}]
+
+def call_cohere_chat(prompt_text: str):
+    """
+    Calls the chat LLM through the provider router (Cohere by default). Returns string or error message.
+    """
+    if not llm_router:
+        _llm_error("not_configured")
+        return _NOT_CONFIGURED
 
     try:
-        response = co.chat(
-            model="command-a-03-2025",
-            messages=messages,
-            max_tokens=MAX_TOKENS,
-            temperature=TEMPERATURE
-        )
-        # Cohere v2 chat returns nested structure; this matches your local usage
-        return response.message.content[0].text.strip()
+        with metrics.span("llm"):
+            answer = llm_router.chat(_chat_messages(prompt_text), MAX_TOKENS, TEMPERATURE)
+        _record_llm_sizes(len(prompt_text), len(answer))
+        return answer
+    except Exception as e:
+        logger.exception("LLM API error")
+        _llm_error(_error_reason(e))
+        return f"[Error calling LLM API: {e}]"
+
+async def acall_cohere_chat(prompt_text: str):
+    """
+    Async variant of call_cohere_chat (the providers' async clients).
+    """
+    if not llm_router:
+        _llm_error("not_configured")
+        return _NOT_CONFIGURED
+
+    try:
+        with metrics.span("llm"):
+            answer = await llm_router.achat(_chat_messages(prompt_text), MAX_TOKENS, TEMPERATURE)
+        _record_llm_sizes(len(prompt_text), len(answer))
+        return answer
+    except Exception as e:
+        logger.exception("LLM API error")
+        _llm_error(_error_reason(e))
+        return f"[Error calling LLM API: {e}]"
+
+def call_cohere_chat_stream(prompt_text: str):
+    """
+    Streaming variant of call_cohere_chat: yields text deltas as the provider produces them.
+    Errors are yielded as a bracketed message, like call_cohere_chat returns them.
+    """
+    if not llm_router:
+        _llm_error("not_configured")
+        yield _NOT_CONFIGURED
+        return
+
+    received = 0
+    try:
+        with metrics.span("llm"):
+            for text in llm_router.chat_stream(_chat_messages(prompt_text), MAX_TOKENS, TEMPERATURE):
+                received += len(text)
+                yield text
+        _record_llm_sizes(len(prompt_text), received)
     except Exception as e:
-        logger.exception("Cohere API error")
-        return f"[Error calling Cohere API: {e}]"
+        logger.exception("LLM API error")
+        _llm_error(_error_reason(e))
+        yield f"[Error calling LLM API: {e}]"
 
 # ------------------------------
-# Doc user_type helper
+# Cache helpers
 # ------------------------------
-def _doc_user_type(doc):
-    meta = getattr(doc, "metadata", None)
-    if isinstance(meta, dict) and "user_type" in meta:
-        return meta.get("user_type")
-    if isinstance(doc, dict):
-        md = doc.get("metadata") or doc.get("meta") or doc.get("meta_data")
-        if isinstance(md, dict) and "user_type" in md:
-            return md.get("user_type")
-    return None
+_context_settings_key = None
+
+def _context_settings():
+    """
+    Every setting that changes which context goes into the prompt, as part of the
+    response-cache key: answers built from a different context are never served.
+    """
+    global _context_settings_key
+    if _context_settings_key is None:
+        r = retriever_module
+        _context_settings_key = make_key(
+            r and (r.RETRIEVER_BACKEND, r.RETRIEVER_MODE, r.HYBRID_CANDIDATES, r.RRF_K),
+            context_packer.CONTEXT_TOKEN_BUDGET, context_packer.CONTEXT_MIN_PARTIAL_TOKENS,
+            context_packer.CONTEXT_TOKENIZER, type(context_packer.get_tokenizer()).__name__,
+            compression.COMPRESSION_ENABLED, compression.COMPRESSION_MIN_SCORE, compression.COMPRESSION_MIN_UNITS,
+            compression.COMPRESSION_MAX_UNITS, sorted(compression.COMPRESSION_KEEP_FIELDS),
+            compression.COMPRESSION_SPLIT_CHARS,
+            relevance.RELEVANCE_MIN_SCORE, relevance.RELEVANCE_HIGH_SCORE, relevance.RELEVANCE_TOKEN_THRESHOLD,
+            CLARIFY_MODE,
+        )
+    return _context_settings_key
+
+def _response_key(question, user_type, top_k, index_version):
+    return make_key(
+        normalize_query(question), (user_type or "").lower(), top_k,
+        llm_router.identity, MAX_TOKENS, TEMPERATURE, PROMPT_VERSION, _context_settings(), index_version,
+    )
+
+def _remember_answer(cache_key, response_key, answer, source_documents):
+    # never serve call_cohere_chat error strings from the cache
+    if answer and not _is_error_text(answer):
+        _answer_cache.store(*cache_key, answer, source_documents)
+        _response_cache.put(response_key, answer, source_documents)
 
 # ------------------------------
 # Main generate_answer function
 # ------------------------------
-def generate_answer(question: str, top_k: int = TOP_K, user_type: str = "general"):
-    """
-    Main RAG generation entrypoint.
-
-    Returns:
-        dict with keys:
-            - "answer": str
-            - "source_documents": list (documents used)
-    """
+def _load_retriever(top_k: int):
+    """Returns (retriever, None), or (None, error result) when it can't be loaded."""
     if get_retriever is None:
-        return {"answer": "Retriever not configured. Ensure retriever.get_retriever is available.", "source_documents": []}
+        return None, {"answer": "Retriever not configured. Ensure retriever.get_retriever is available.", "source_documents": []}
 
     try:
-        retriever = get_retriever()
+        return get_retriever(k=top_k), None
     except FileNotFoundError as e:
         # indices missing
         logger.error("Retriever indices missing: %s", e)
-        return {"answer": "Knowledge base not found. Please run ingest to create the indices.", "source_documents": []}
+        return None, {"answer": "Knowledge base not found. Please run ingest to create the indices.", "source_documents": []}
     except Exception as e:
         logger.exception("Failed to initialize retriever")
-        return {"answer": f"Retriever initialization error: {e}", "source_documents": []}
-
-    # Get candidate docs (we request a bit more then filter)
-    try:
-        docs = retriever.get_relevant_documents(question)
-    except Exception as e:
-        logger.exception("Retrieval error")
-        return {"answer": f"Retrieval error: {e}", "source_documents": []}
+        return None, {"answer": f"Retriever initialization error: {e}", "source_documents": []}
 
+def _cached_answer(retriever, question: str, top_k: int, user_type: str, question_emb=None):
+    """
+    Looks the question up in the exact and semantic answer caches.
+    Returns (result, None) on a hit, or (None, cache_keys) for _remember_answer;
+    cache_keys[0][0] is the question embedding, for reuse by retrieval.
+    """
+    index_version = get_index_version()
+    response_key = _response_key(question, user_type, top_k, index_version)
+    with metrics.span("response_cache"):
+        cached = _response_cache.get(response_key)
+    metrics.inc("rag_cache_misses_total" if cached is None else "rag_cache_hits_total", cache="response")
+    if cached is None:
+        if question_emb is None:
+            question_emb = retriever.embed_query(question)
+        cache_key = (question_emb, ((user_type or "").lower(), top_k), index_version)
+        with metrics.span("semantic_cache"):
+            cached = _answer_cache.lookup(*cache_key)
+        if cached is None:
+            metrics.annotate(cache="miss")
+            return None, (cache_key, response_key)
+        metrics.annotate(cache="semantic")
+    else:
+        metrics.annotate(cache="response")
+    answer, sources = cached
+    return {"answer": answer, "source_documents": sources}, None
+
+def _compress(retriever, question_emb, docs, top_k: int):
+    """Optional query-focused extraction of the top_k docs (COMPRESSION_ENABLED)."""
+    if not COMPRESSION_ENABLED or not docs:
+        return docs
+    with metrics.span("compress"):
+        compressed = compress_docs(question_emb, docs[:top_k], retriever.embed_model)
+    metrics.annotate(compressed_chars_saved=sum(len(d["page_content"]) for d in docs[:top_k])
+                     - sum(len(d["page_content"]) for d in compressed))
+    return compressed
+
+def _plan_from_docs(question: str, docs, top_k: int, user_type: str, cache_keys):
     if not docs:
         return {"answer": "I couldn't find any relevant documents.", "source_documents": []}
 
-    # Filter by user_type if any docs have metadata for it
-    matching = [d for d in docs if (_doc_user_type(d) or "").lower() == (user_type or "").lower()]
-    selected_docs = matching[:top_k] if matching else docs[:top_k]
-
-    context_text = build_context_snippet(selected_docs)
+    # user_type filtering already happened inside the vector query
+    selected_docs = docs[:top_k]
+
+    # similarity scores from the vector query + token sets stored at ingest; no pass over the context text
+    with metrics.span("relevance_gate"):
+        relevant, best_score = relevance_gate(question, selected_docs)
+    metrics.annotate(top_score=best_score)
+    if not relevant and CLARIFY_MODE == "template":
+        metrics.inc("rag_clarify_template_total", help_text="Clarifying answers built without an LLM call")
+        metrics.annotate(clarifying=True)
+        return {"answer": clarifying_answer(selected_docs), "source_documents": selected_docs}
+
+    with metrics.span("build_context"):
+        packed = pack_context(selected_docs)
+        context_text = packed.text
+    # only docs that made it into the prompt are cited as sources
+    selected_docs = packed.docs
+    metrics.inc("rag_context_tokens_saved_total", packed.saved_tokens,
+                help_text="Context tokens removed by dedup/budgeting")
+    metrics.annotate(docs=len(selected_docs), context_chars=len(context_text), context_tokens=packed.tokens,
+                     context_tokens_saved=packed.saved_tokens, clarifying=not relevant)
+    logger.debug("Packed %d docs into %d context tokens (%d saved)", len(selected_docs), packed.tokens, packed.saved_tokens)
 
     # If context seems weak, ask a short clarifying question
-    if not is_context_relevant(question, context_text):
-        clarifying_prompt = (
+    if not relevant:
+        prompt = (
             f"The context may be insufficient.\n\nCONTEXT:\n{context_text}\n\nQUESTION:\n{question}\n"
             "Ask one short clarifying question to the user. Do not answer yet."
         )
-        clarifying = call_cohere_chat(clarifying_prompt)
-        return {"answer": clarifying, "source_documents": selected_docs}
+    else:
+        # Build the final prompt for Cohere
+        prompt = textwrap.dedent(
+            f"""
+            CONTEXT:
+            {context_text}
+
+            QUESTION:
+            {question}
+
+            USER TYPE:
+            {user_type}
+
+            Instruction: Answer concisely, tailor to the user type, say 'I don't know' if not in context.
+            """
+        ).strip()
 
-    # Build the final prompt for Cohere
-    prompt = textwrap.dedent(
-        f"""
-        CONTEXT:
-        {context_text}
+    return {"prompt": prompt, "source_documents": selected_docs, "cache_keys": cache_keys}
+
+def _prepare_generation(question: str, top_k: int, user_type: str):
+    """
+    Everything up to the LLM call: caches, retrieval, filtering and prompt building.
+
+    Returns either {"answer", "source_documents"} when no LLM call is needed,
+    or {"prompt", "source_documents", "cache_keys"} for the caller to send
+    to Cohere (blocking or streaming) and then pass to _remember_answer.
+    """
+    retriever, error = _load_retriever(top_k)
+    if error:
+        return error
+
+    # Get the top_k docs for this user_type (filtered inside the search)
+    try:
+        cached, cache_keys = _cached_answer(retriever, question, top_k, user_type)
+        if cached is not None:
+            return cached
+        # the embedding from the answer-cache lookup, so the query is encoded once
+        question_emb = cache_keys[0][0]
+        with metrics.span("retrieve"):
+            docs = retriever.get_relevant_documents(question, user_type=user_type, embedding=question_emb)
+        docs = _compress(retriever, question_emb, docs, top_k)
+    except Exception as e:
+        logger.exception("Retrieval error")
+        return {"answer": f"Retrieval error: {e}", "source_documents": []}
 
-        QUESTION:
-        {question}
+    return _plan_from_docs(question, docs, top_k, user_type, cache_keys)
 
-        USER TYPE:
-        {user_type}
+def generate_answer(question: str, top_k: int = TOP_K, user_type: str = "general"):
+    """
+    Main RAG generation entrypoint.
 
-        Instruction: Answer concisely, tailor to the user type, say 'I don't know' if not in context.
-        """
-    ).strip()
+    Returns:
+        dict with keys:
+            - "answer": str
+            - "source_documents": list (documents used)
+    """
+    with metrics.request("generate_answer", user_type=user_type, top_k=top_k):
+        plan = _prepare_generation(question, top_k, user_type)
+        if "answer" in plan:
+            return plan
 
-    answer = call_cohere_chat(prompt)
-    return {"answer": answer, "source_documents": selected_docs}
+        answer = call_cohere_chat(plan["prompt"])
+        _remember_answer(*plan["cache_keys"], answer, plan["source_documents"])
+        return {"answer": answer, "source_documents": plan["source_documents"]}
 
+def generate_answer_stream(question: str, top_k: int = TOP_K, user_type: str = "general"):
+    """
+    Streaming counterpart of generate_answer.
 
+    Retrieval runs eagerly; the Cohere call is deferred until the stream is consumed.
+
+    Returns:
+        dict with keys:
+            - "answer_stream": iterator of str chunks
+            - "source_documents": list (documents used)
+    """
+    # the request record covers retrieval; the streamed LLM call is timed by its own "llm" span
+    with metrics.request("generate_answer_stream", user_type=user_type, top_k=top_k):
+        plan = _prepare_generation(question, top_k, user_type)
+    if "answer" in plan:
+        return {"answer_stream": iter([plan["answer"]]), "source_documents": plan["source_documents"]}
+
+    def stream():
+        parts = []
+        for text in call_cohere_chat_stream(plan["prompt"]):
+            parts.append(text)
+            yield text
+        # an error may arrive after some text was already streamed
+        if parts and not _is_error_text(parts[-1]):
+            _remember_answer(*plan["cache_keys"], "".join(parts).strip(), plan["source_documents"])
+
+    return {"answer_stream": stream(), "source_documents": plan["source_documents"]}
+
+# ------------------------------
+# Async generate_answer
+# ------------------------------
+_retrieval_pool = None
+_pool_lock = Lock()
+
+def _get_retrieval_pool():
+    global _retrieval_pool
+    if _retrieval_pool is None:
+        with _pool_lock:
+            if _retrieval_pool is None:
+                _retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+    return _retrieval_pool
+
+async def agenerate_answer(question: str, top_k: int = TOP_K, user_type: str = "general"):
+    """
+    Async counterpart of generate_answer.
+
+    The blocking part (caches, embedding, Chroma query) runs on a small
+    thread pool and the Cohere call is awaited, so many questions can be
+    in flight on one event loop. Returns the same dict as generate_answer.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_retrieval_pool()
+    with metrics.request("agenerate_answer", user_type=user_type, top_k=top_k):
+        with metrics.span("prepare"):
+            # run_in_executor doesn't carry contextvars over: copy them, so the pool thread's
+            # spans and annotations land in this request's record
+            plan = await loop.run_in_executor(pool, contextvars.copy_context().run,
+                                              _prepare_generation, question, top_k, user_type)
+        if "answer" in plan:
+            return plan
+
+        answer = await acall_cohere_chat(plan["prompt"])
+        await loop.run_in_executor(pool, contextvars.copy_context().run,
+                                   _remember_answer, *plan["cache_keys"], answer, plan["source_documents"])
+        return {"answer": answer, "source_documents": plan["source_documents"]}
+
+# ------------------------------
+# Batch question answering
+# ------------------------------
+def generate_answers_batch(questions, top_k: int = TOP_K, user_type: str = "general", concurrency: int = BATCH_CONCURRENCY):
+    """
+    Answers many questions at once, e.g. to replay historical tickets.
+
+    Questions are embedded in one batched encode call, every cache miss is
+    retrieved with a single multi-embedding Chroma query, and the Cohere
+    calls run on up to `concurrency` threads.
+
+    Returns:
+        list of generate_answer-style dicts, in input order
+    """
+    questions = list(questions)
+    retriever, error = _load_retriever(top_k)
+    if error:
+        return [dict(error) for _ in questions]
+
+    results = [None] * len(questions)
+    try:
+        # one batched encode; the vectors are passed on, so nothing below encodes again
+        embs = retriever.embed_queries(questions)
+        pending = []
+        for i, question in enumerate(questions):
+            cached, cache_keys = _cached_answer(retriever, question, top_k, user_type, question_emb=embs[i])
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append((i, cache_keys))
+        docs_batch = retriever.get_relevant_documents_batch(
+            [questions[i] for i, _ in pending], user_type=user_type, embeddings=[embs[i] for i, _ in pending])
+        docs_batch = [_compress(retriever, embs[i], docs, top_k) for (i, _), docs in zip(pending, docs_batch)]
+    except Exception as e:
+        logger.exception("Retrieval error")
+        return [r or {"answer": f"Retrieval error: {e}", "source_documents": []} for r in results]
+
+    plans = []
+    for (i, cache_keys), docs in zip(pending, docs_batch):
+        plan = _plan_from_docs(questions[i], docs, top_k, user_type, cache_keys)
+        if "answer" in plan:
+            results[i] = plan
+        else:
+            plans.append((i, plan))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        answers = pool.map(call_cohere_chat, [plan["prompt"] for _, plan in plans])
+        for (i, plan), answer in zip(plans, answers):
+            _remember_answer(*plan["cache_keys"], answer, plan["source_documents"])
+            results[i] = {"answer": answer, "source_documents": plan["source_documents"]}
+    return results
@@ -2,69 +2,453 @@
 import os
 import json
 import glob
+import hashlib
+import sqlite3
+import argparse
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
+import chromadb
 from dotenv import load_dotenv
-from langchain_community.document_loaders import TextLoader, PyPDFLoader
-from langchain_text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.document_loaders import TextLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document  # ⚠️ Important
 
+try:
+    from src.lexical import build_bm25_index
+    from src.relevance import TOKENS_KEY, chunk_tokens
+    from src.embeddings import load_embedding_model, embedding_model_id
+except Exception:
+    from lexical import build_bm25_index
+    from relevance import TOKENS_KEY, chunk_tokens
+    from embeddings import load_embedding_model, embedding_model_id
+
 load_dotenv()
 
 DATA_DIR = os.getenv("DATA_DIR", "./data")
 CHROMA_DIR = os.getenv("INDICES_DIR", "./indices")
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION", "faq_data")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(CHROMA_DIR, "embedding_cache.sqlite3"))
+INDEX_VERSION_PATH = os.path.join(CHROMA_DIR, "index_version")
+# exact-search sidecar files read by the "numpy" retriever backend
+NUMPY_EMBEDDINGS_PATH = os.path.join(CHROMA_DIR, "embeddings.npy")
+NUMPY_CHUNKS_PATH = os.path.join(CHROMA_DIR, "chunks.jsonl")
+# BM25 term statistics for hybrid (lexical + dense) retrieval
+BM25_INDEX_PATH = os.path.join(CHROMA_DIR, "bm25_index.json")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "50"))
+# user_type stored on chunks that apply to every platform
+ALL_USER_TYPES = "all"
 
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(CHROMA_DIR, exist_ok=True)
 
-def load_documents():
-    """Loads text, PDF, and JSON files from data directory."""
-    docs = []
-    files = glob.glob(os.path.join(DATA_DIR, "*"))
+# ------------------------------
+# Loading & splitting (streaming)
+# ------------------------------
+def _json_documents(file):
+    with open(file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    items = data if isinstance(data, list) else [data]
+    # Wrap dict as a Document
+    return [Document(page_content=json.dumps(item), metadata=_record_metadata(file, item)) for item in items]
+
+def _record_metadata(file, item):
+    """Structured metadata for a JSON record, used for filtering inside the vector query."""
+    metadata = {"source": file}
+    if isinstance(item, dict):
+        if item.get("Service"):
+            metadata["Service"] = str(item["Service"])
+        if item.get("Issue"):
+            # shown as an option when the app asks the user to clarify
+            metadata["Issue"] = str(item["Issue"])
+        if item.get("user_type"):
+            metadata["user_type"] = str(item["user_type"]).lower()
+    return metadata
+
+def _pdf_documents(file, page_range=None):
+    """
+    One Document per PDF page, with a fixed {"source", "page"} metadata schema, so
+    serial runs, whole-file tasks and page-range tasks produce the same chunk ids.
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(file)
+    start, end = page_range or (0, len(reader.pages))
+    for i in range(start, end):
+        yield Document(page_content=reader.pages[i].extract_text() or "", metadata={"source": file, "page": i})
+
+def _iter_file(file):
+    ext = os.path.splitext(file)[1].lower()
+    if ext == ".pdf":
+        yield from _pdf_documents(file)
+    elif ext == ".txt":
+        yield from TextLoader(file, encoding="utf-8").lazy_load()
+    elif ext == ".json":
+        yield from _json_documents(file)
+    else:
+        print(f"⚠️ Skipping unsupported file: {file}")
+
+def _pdf_page_count(file):
+    from pypdf import PdfReader
+    return len(PdfReader(file).pages)
+
+def _load_task(task):
+    """Worker entry point: parse one file (or one page range of a PDF). Never raises."""
+    file, page_range = task
+    try:
+        if page_range is None:
+            return task, list(_iter_file(file)), None
+        return task, list(_pdf_documents(file, page_range)), None
+    except Exception as e:
+        return task, [], f"{type(e).__name__}: {e}"
+
+def _plan_tasks(files):
+    """One task per file, except large PDFs which are split into page ranges."""
     for file in files:
-        ext = os.path.splitext(file)[1].lower()
-        if ext == ".pdf":
-            loader = PyPDFLoader(file)
-            docs.extend(loader.load())
-        elif ext == ".txt":
-            loader = TextLoader(file, encoding="utf-8")
-            docs.extend(loader.load())
-        elif ext == ".json":
-            with open(file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    for item in data:
-                        # Wrap dict as a Document
-                        docs.append(Document(page_content=json.dumps(item)))
-                else:
-                    docs.append(Document(page_content=json.dumps(data)))
-        else:
-            print(f"⚠️ Skipping unsupported file: {file}")
-    return docs
-
-def create_chroma_index():
-    print("📂 Loading documents...")
-    docs = load_documents()
-    if not docs:
-        print("❌ No files found in /data. Please add PDF, TXT, or JSON files first.")
+        if os.path.splitext(file)[1].lower() == ".pdf":
+            try:
+                n_pages = _pdf_page_count(file)
+            except Exception:
+                n_pages = 0  # let the worker report the parse error
+            if n_pages > PDF_PAGES_PER_TASK:
+                for start in range(0, n_pages, PDF_PAGES_PER_TASK):
+                    yield file, (start, min(start + PDF_PAGES_PER_TASK, n_pages))
+                continue
+        yield file, None
+
+def iter_documents(workers=INGEST_WORKERS, failed=None):
+    """
+    Yields Documents from the text, PDF, and JSON files in the data directory.
+
+    With workers > 1 files (and page ranges of large PDFs) are parsed in a
+    process pool; results are still yielded in sorted file/page order. A file
+    that fails to parse (in any of its page ranges) is reported and appended
+    to `failed` instead of aborting the run, and none of its documents are
+    yielded.
+    """
+    files = sorted(glob.glob(os.path.join(DATA_DIR, "*")))
+    failed = failed if failed is not None else []
+
+    def report(file, error):
+        if file not in failed:
+            failed.append(file)
+        print(f"❌ Failed to parse {file}: {error}")
+
+    if workers <= 1:
+        for file in files:
+            try:
+                docs = list(_iter_file(file))
+            except Exception as e:
+                report(file, f"{type(e).__name__}: {e}")
+                continue
+            yield from docs
         return
 
-    print(f"✅ Loaded {len(docs)} documents.")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # keep a bounded window of tasks in flight so results don't pile up in memory
+        pending = deque()
+        tasks = _plan_tasks(files)
+        for task in islice(tasks, workers * 2):
+            pending.append(pool.submit(_load_task, task))
+        # a file's page ranges arrive one after another; hold them until the last one
+        # so a file with a failed range is skipped as a whole, like a failed single task
+        current, buffered = None, []
+        while pending:
+            (file, _), docs, error = pending.popleft().result()
+            next_task = next(tasks, None)
+            if next_task is not None:
+                pending.append(pool.submit(_load_task, next_task))
+            if file != current:
+                if current not in failed:
+                    yield from buffered
+                current, buffered = file, []
+            if error:
+                report(file, error)
+                buffered = []
+            elif file not in failed:
+                buffered.extend(docs)
+        if current not in failed:
+            yield from buffered
+
+def load_documents():
+    """Loads text, PDF, and JSON files from data directory."""
+    return list(iter_documents())
 
-    # Split text into manageable chunks
+def iter_chunks(docs):
+    """Split documents one at a time, yielding (chunk_id, chunk) and skipping exact duplicates."""
     splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = splitter.split_documents(docs)
-    print(f"🧩 Split into {len(chunks)} chunks.")
+    seen = set()
+    for doc in docs:
+        for chunk in splitter.split_documents([doc]):
+            # chunks without a platform apply to all of them
+            chunk.metadata.setdefault("user_type", ALL_USER_TYPES)
+            # precomputed for the relevance gate, so queries never re-tokenize the context
+            chunk.metadata[TOKENS_KEY] = chunk_tokens(chunk.page_content)
+            cid = chunk_id(chunk)
+            if cid not in seen:
+                seen.add(cid)
+                yield cid, chunk
+
+def split_documents(docs):
+    """Split documents into chunks and drop exact duplicates (same chunk id)."""
+    return dict(iter_chunks(docs))
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+# ------------------------------
+# Content hashing & embedding cache
+# ------------------------------
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_id(chunk) -> str:
+    """
+    Stable id for a chunk: hash of its content and metadata (incl. source), so
+    unchanged chunks keep their id across runs and metadata edits are re-upserted.
+    """
+    return content_hash(json.dumps([chunk.page_content, chunk.metadata or {}], sort_keys=True, default=str))
 
-    # Create embeddings
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+class EmbeddingCache:
+    """On-disk cache of chunk embeddings keyed by (model, content hash)."""
 
-    # Create and persist Chroma vector store
-    print("⚙️ Creating Chroma index...")
-    vectordb = Chroma.from_documents(chunks, embedding=embeddings, persist_directory=CHROMA_DIR)
-    vectordb.persist()
+    def __init__(self, path=EMBED_CACHE_PATH, model_name=None):
+        # backend is part of the key so torch and ONNX vectors are never mixed
+        self.model_name = model_name or embedding_model_id()
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self.conn.commit()
 
-    print(f"✅ Chroma index saved successfully at: {CHROMA_DIR}")
+    def get_many(self, hashes):
+        found = {}
+        hashes = list(hashes)
+        # stay well under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            part = hashes[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                [self.model_name, *part],
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+            [(self.model_name, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def embed_texts(texts, embeddings, cache):
+    """Embed texts, only calling the model for content not already in the cache."""
+    hashes = [content_hash(t) for t in texts]
+    cached = cache.get_many(set(hashes))
+    missing = {}
+    for h, t in zip(hashes, texts):
+        if h not in cached:
+            missing.setdefault(h, t)
+    if missing:
+        vectors = embeddings.encode(list(missing.values()), convert_to_numpy=True, show_progress_bar=False).tolist()
+        new_items = list(zip(missing.keys(), vectors))
+        cache.put_many(new_items)
+        cached.update(new_items)
+    return [cached[h] for h in hashes], len(missing)
+
+# ------------------------------
+# Index builders
+# ------------------------------
+def write_index_version():
+    """Bump the index version so readers (e.g. the answer cache) drop state built on the old index."""
+    version = uuid.uuid4().hex
+    tmp_path = INDEX_VERSION_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, INDEX_VERSION_PATH)
+    return version
+
+def export_numpy_index(collection, batch_size=INGEST_BATCH_SIZE):
+    """
+    Write every chunk's L2-normalized embedding to embeddings.npy (float32,
+    one row per chunk) and its id/text/metadata to chunks.jsonl in the same
+    order, paging through the collection so memory stays bounded.
+    """
+    total = collection.count()
+    emb_tmp, chunks_tmp = NUMPY_EMBEDDINGS_PATH + ".tmp", NUMPY_CHUNKS_PATH + ".tmp"
+    matrix = None
+    row = 0
+    with open(chunks_tmp, "w", encoding="utf-8") as f:
+        for offset in range(0, total, batch_size):
+            page = collection.get(
+                include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset
+            )
+            vectors = np.asarray(page["embeddings"], dtype=np.float32)
+            if not len(vectors):
+                break
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(emb_tmp, mode="w+", dtype=np.float32, shape=(total, vectors.shape[1]))
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            matrix[row:row + len(vectors)] = vectors / np.where(norms == 0, 1, norms)
+            row += len(vectors)
+            for cid, doc, md in zip(page["ids"], page["documents"], page["metadatas"]):
+                f.write(json.dumps({"id": cid, "document": doc, "metadata": md}) + "\n")
+    if matrix is None:
+        matrix = np.lib.format.open_memmap(emb_tmp, mode="w+", dtype=np.float32, shape=(0, 0))
+    matrix.flush()
+    del matrix
+    os.replace(emb_tmp, NUMPY_EMBEDDINGS_PATH)
+    os.replace(chunks_tmp, NUMPY_CHUNKS_PATH)
+
+def iter_exported_chunks():
+    with open(NUMPY_CHUNKS_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+def finalize_index(collection, batch_size=INGEST_BATCH_SIZE):
+    """Rebuild the sidecar files derived from the collection, then bump the index version."""
+    export_numpy_index(collection, batch_size=batch_size)
+    build_bm25_index(
+        ((c["id"], c["document"], (c["metadata"] or {}).get("user_type")) for c in iter_exported_chunks()),
+        BM25_INDEX_PATH,
+    )
+    write_index_version()
+
+def sidecars_exist():
+    return all(
+        os.path.exists(p)
+        for p in (NUMPY_EMBEDDINGS_PATH, NUMPY_CHUNKS_PATH, BM25_INDEX_PATH, INDEX_VERSION_PATH)
+    )
+
+def index_chunks(collection, chunks, batch_size=INGEST_BATCH_SIZE, skip_ids=frozenset()):
+    """
+    Embed and upsert (chunk_id, chunk) pairs in fixed-size batches.
+
+    Only one batch of chunks and vectors is held in memory at a time, so the
+    first upsert happens before later files have even been parsed.
+    Returns (seen_ids, upserted, embedded).
+    """
+    embeddings = None
+    cache = EmbeddingCache()
+    seen_ids, upserted, embedded = set(), 0, 0
+    try:
+        for batch in batched(chunks, batch_size):
+            seen_ids.update(cid for cid, _ in batch)
+            batch = [(cid, chunk) for cid, chunk in batch if cid not in skip_ids]
+            if not batch:
+                continue
+            if embeddings is None:
+                # same model (and backend) the retriever encodes queries with
+                embeddings = load_embedding_model()
+            texts = [chunk.page_content for _, chunk in batch]
+            vectors, n_embedded = embed_texts(texts, embeddings, cache)
+            collection.upsert(
+                ids=[cid for cid, _ in batch],
+                documents=texts,
+                embeddings=vectors,
+                metadatas=[chunk.metadata or None for _, chunk in batch],
+            )
+            upserted += len(batch)
+            embedded += n_embedded
+            print(f"   ↳ {upserted} chunks written ({embedded} embedded)")
+    finally:
+        cache.close()
+    return seen_ids, upserted, embedded
+
+def update_chroma_index(batch_size=INGEST_BATCH_SIZE, workers=INGEST_WORKERS):
+    """
+    Incrementally sync the Chroma collection with DATA_DIR.
+
+    Chunks are keyed by content hash: new chunks are embedded (through the
+    on-disk embedding cache) and upserted, chunks that no longer exist are
+    deleted, and unchanged chunks are left alone.
+    """
+    client = chromadb.PersistentClient(path=CHROMA_DIR)
+    collection = client.get_or_create_collection(COLLECTION_NAME)
+    existing_ids = set(collection.get(include=[])["ids"])
+
+    print("📂 Streaming documents...")
+    failed = []
+    seen_ids, upserted, embedded = index_chunks(
+        collection, iter_chunks(iter_documents(workers=workers, failed=failed)),
+        batch_size=batch_size, skip_ids=existing_ids,
+    )
+    if not seen_ids:
+        if failed:
+            # nothing parsed: keep the index as it is rather than guess which chunks are stale
+            print(f"❌ No documents could be parsed; index left unchanged. Failed: {failed}")
+            return
+        print("⚠️ No files found in /data; removing all indexed chunks.")
+
+    stale_ids = list(existing_ids - seen_ids)
+    if failed and stale_ids:
+        # keep the previous chunks of files we couldn't parse this time
+        stale = collection.get(ids=stale_ids, include=["metadatas"])
+        stale_ids = [
+            cid for cid, md in zip(stale["ids"], stale["metadatas"])
+            if (md or {}).get("source") not in failed
+        ]
+    for batch in batched(stale_ids, batch_size):
+        collection.delete(ids=batch)
+    if upserted or stale_ids or not sidecars_exist():
+        finalize_index(collection, batch_size=batch_size)
+
+    print(
+        f"✅ Index updated at {CHROMA_DIR}: +{upserted} / -{len(stale_ids)} chunks, "
+        f"{len(seen_ids) - upserted} unchanged, {embedded} embeddings computed."
+    )
+    if failed:
+        print(f"⚠️ {len(failed)} file(s) failed to parse and were left as previously indexed: {failed}")
+
+def create_chroma_index(batch_size=INGEST_BATCH_SIZE, workers=INGEST_WORKERS):
+    client = chromadb.PersistentClient(path=CHROMA_DIR)
+    # drop the old collection so removed chunks don't linger
+    try:
+        client.delete_collection(COLLECTION_NAME)
+    except Exception:
+        pass
+    collection = client.create_collection(COLLECTION_NAME)
+
+    print("📂 Streaming documents into a new Chroma index...")
+    failed = []
+    seen_ids, upserted, embedded = index_chunks(
+        collection, iter_chunks(iter_documents(workers=workers, failed=failed)), batch_size=batch_size
+    )
+    if not seen_ids:
+        print("❌ No files found in /data. Please add PDF, TXT, or JSON files first.")
+        return
+
+    finalize_index(collection, batch_size=batch_size)
+    print(f"✅ Chroma index saved successfully at: {CHROMA_DIR} ({upserted} chunks, {embedded} embeddings computed)")
+    if failed:
+        print(f"⚠️ {len(failed)} file(s) failed to parse and were skipped: {failed}")
 
 if __name__ == "__main__":
-    create_chroma_index()
+    parser = argparse.ArgumentParser(description="Build the Chroma index from DATA_DIR.")
+    parser.add_argument("--incremental", action="store_true",
+                        default=os.getenv("INGEST_INCREMENTAL", "0") == "1",
+                        help="only embed new/changed chunks and delete removed ones")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE,
+                        help="chunks embedded and written per batch (bounds peak memory)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS,
+                        help="processes used to parse files / PDF page ranges (1 = serial)")
+    args = parser.parse_args()
+
+    if args.incremental:
+        update_chroma_index(batch_size=args.batch_size, workers=args.workers)
+    else:
+        create_chroma_index(batch_size=args.batch_size, workers=args.workers)
@@ -0,0 +1,123 @@
+# src/lexical.py
+import re
+import json
+import math
+import os
+from collections import Counter
+import numpy as np
+
+_token_pattern = re.compile(r"\w+")
+
+# very common words that only add noise to short keyword queries
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it my of on or so the this to "
+    "what when where which why will with you your".split()
+)
+
+# FAQ record fields that carry the most lexical signal get their terms counted more than once
+FIELD_WEIGHTS = {"Keyword": 3, "Issue": 2, "SubIssue": 2, "SubIssue1": 2, "Service": 1}
+
+def tokenize(text: str):
+    return [t for t in _token_pattern.findall((text or "").lower()) if t not in STOPWORDS]
+
+def document_terms(text: str):
+    """Terms for a chunk; JSON FAQ records weight Keyword/Issue fields above the response body."""
+    try:
+        record = json.loads(text)
+    except (ValueError, TypeError):
+        record = None
+    if not isinstance(record, dict):
+        return tokenize(text)
+    terms = []
+    for field, value in record.items():
+        if isinstance(value, str):
+            terms.extend(tokenize(value) * FIELD_WEIGHTS.get(field, 1))
+    return terms
+
+def build_bm25_index(rows, path, k1=1.5, b=0.75):
+    """
+    Build BM25 term statistics for (chunk_id, text, partition) rows and write them to `path` as JSON.
+
+    Postings are stored per term as parallel [row indices], [term frequencies]
+    lists, in the same row order as the rows given (i.e. chunks.jsonl). The
+    partition (the chunk's user_type) lets searches be restricted to a subset.
+    """
+    ids, doc_lens, partitions, postings = [], [], [], {}
+    for row, (cid, text, partition) in enumerate(rows):
+        counts = Counter(document_terms(text))
+        ids.append(cid)
+        doc_lens.append(sum(counts.values()))
+        partitions.append(partition)
+        for term, tf in counts.items():
+            entry = postings.setdefault(term, ([], []))
+            entry[0].append(row)
+            entry[1].append(tf)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"k1": k1, "b": b, "ids": ids, "doc_lens": doc_lens, "partitions": partitions, "postings": postings},
+            f, separators=(",", ":"),
+        )
+    os.replace(tmp_path, path)
+
+class BM25Index:
+    """In-memory BM25 scorer over the postings written by build_bm25_index."""
+
+    def __init__(self, ids, doc_lens, postings, partitions=None, k1=1.5, b=0.75):
+        self.ids = ids
+        self.row_of = {cid: row for row, cid in enumerate(ids)}
+        self.partitions = np.asarray(partitions if partitions is not None else [None] * len(ids), dtype=object)
+        self._masks = {}
+        n_docs = len(ids)
+        doc_lens = np.asarray(doc_lens, dtype=np.float32)
+        avgdl = float(doc_lens.mean()) if n_docs else 0.0
+        # per-document length normalisation, precomputed once
+        self._norm = k1 * (1 - b + b * doc_lens / avgdl) if avgdl else np.full(n_docs, k1, dtype=np.float32)
+        self._k1 = k1
+        self._postings = {}
+        for term, (rows, tfs) in postings.items():
+            idf = math.log(1 + (n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+            self._postings[term] = (np.asarray(rows, dtype=np.int64), np.asarray(tfs, dtype=np.float32), idf)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["ids"], data["doc_lens"], data["postings"], partitions=data.get("partitions"),
+                   k1=data["k1"], b=data["b"])
+
+    def mask(self, partitions):
+        """Boolean row mask for a tuple of partitions (cached)."""
+        if partitions not in self._masks:
+            self._masks[partitions] = np.isin(self.partitions, list(partitions))
+        return self._masks[partitions]
+
+    def search(self, query: str, top_n: int, partitions=None):
+        """
+        Returns up to top_n (row, score) pairs with a positive score, best first,
+        optionally restricted to rows in the given tuple of partitions.
+        """
+        if top_n <= 0:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            rows, tfs, idf = posting
+            scores[rows] += idf * tfs * (self._k1 + 1) / (tfs + self._norm[rows])
+        if partitions is not None:
+            scores[~self.mask(partitions)] = 0
+        hits = np.flatnonzero(scores)
+        if len(hits) > top_n:
+            hits = hits[np.argpartition(-scores[hits], top_n - 1)[:top_n]]
+        hits = hits[np.argsort(-scores[hits])]
+        return [(int(row), float(scores[row])) for row in hits]
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several ranked id lists; ids ranked high in any list float to the top."""
+    fused = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
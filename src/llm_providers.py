@@ -0,0 +1,331 @@
+# src/llm_providers.py
+import os
+import time
+import random
+import asyncio
+import itertools
+import logging
+from abc import ABC, abstractmethod
+from threading import Lock
+from dotenv import load_dotenv
+
+try:
+    from src import metrics
+    from src.resilience import LLM_TIMEOUT, ResilientCaller
+except Exception:
+    import metrics
+    from resilience import LLM_TIMEOUT, ResilientCaller
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ------------------------------
+# Config from env
+# ------------------------------
+# comma-separated providers the router may use ("cohere", "mistral", "stub"); with several,
+# each request goes to the fastest healthy one and falls back to the others on failure
+LLM_PROVIDERS = [p.strip().lower() for p in os.getenv("LLM_PROVIDERS", "cohere").split(",") if p.strip()]
+COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+COHERE_MODEL = os.getenv("COHERE_MODEL", "command-a-03-2025")
+# point the client at another endpoint, e.g. benchmarks/fake_cohere_server.py
+COHERE_BASE_URL = os.getenv("COHERE_BASE_URL") or None
+MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", "mistral-small-latest")
+MISTRAL_BASE_URL = os.getenv("MISTRAL_BASE_URL") or None
+STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "50"))
+# keep-alive connections per provider, shared by every request of the process
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+LLM_KEEPALIVE = float(os.getenv("LLM_KEEPALIVE", "60"))  # seconds an idle connection is kept
+# providers failing more often than this (rolling window) are only tried after healthy ones
+LLM_MAX_ERROR_RATE = float(os.getenv("LLM_MAX_ERROR_RATE", "0.5"))
+# share of requests sent to a random provider, so a slower one's latency stays measured
+LLM_ROUTER_EXPLORE = float(os.getenv("LLM_ROUTER_EXPLORE", "0.05"))
+
+def _http_clients():
+    """Pooled sync/async httpx clients for one provider's SDK clients."""
+    import httpx
+
+    limits = httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE,
+                          keepalive_expiry=LLM_KEEPALIVE)
+    return httpx.Client(limits=limits, timeout=LLM_TIMEOUT), httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT)
+
+# ------------------------------
+# Providers
+# ------------------------------
+class LLMProvider(ABC):
+    """
+    One chat backend. `messages` are [{"role", "content"}] dicts; `timeout` is
+    the per-attempt limit in seconds chosen by the router's ResilientCaller.
+    Subclasses must implement all three methods.
+    """
+
+    name = "base"
+    model = None
+
+    @abstractmethod
+    def chat(self, messages, max_tokens, temperature, timeout) -> str:
+        ...
+
+    @abstractmethod
+    async def achat(self, messages, max_tokens, temperature, timeout) -> str:
+        ...
+
+    @abstractmethod
+    def chat_stream(self, messages, max_tokens, temperature, timeout):
+        """Yields text deltas."""
+
+class CohereProvider(LLMProvider):
+    name = "cohere"
+
+    def __init__(self, api_key=COHERE_API_KEY, model=COHERE_MODEL, base_url=COHERE_BASE_URL,
+                 client=None, async_client=None):
+        self.model = model
+        if client is None or async_client is None:
+            import cohere
+
+            http_client, http_async_client = _http_clients()
+            kwargs = {"base_url": base_url} if base_url else {}
+            client = client or cohere.ClientV2(api_key=api_key, httpx_client=http_client, **kwargs)
+            async_client = async_client or cohere.AsyncClientV2(api_key=api_key, httpx_client=http_async_client, **kwargs)
+        self.client = client
+        self.async_client = async_client
+
+    @staticmethod
+    def _request_options(timeout):
+        # retries are the router's (resilience.py), so the SDK's own are turned off
+        return {"timeout_in_seconds": max(1, int(timeout + 0.999)), "max_retries": 0}
+
+    def chat(self, messages, max_tokens, temperature, timeout):
+        response = self.client.chat(model=self.model, messages=messages, max_tokens=max_tokens,
+                                    temperature=temperature, request_options=self._request_options(timeout))
+        # Cohere v2 chat returns nested structure
+        return response.message.content[0].text.strip()
+
+    async def achat(self, messages, max_tokens, temperature, timeout):
+        response = await self.async_client.chat(model=self.model, messages=messages, max_tokens=max_tokens,
+                                                temperature=temperature, request_options=self._request_options(timeout))
+        return response.message.content[0].text.strip()
+
+    def chat_stream(self, messages, max_tokens, temperature, timeout):
+        for event in self.client.chat_stream(model=self.model, messages=messages, max_tokens=max_tokens,
+                                             temperature=temperature, request_options=self._request_options(timeout)):
+            if event.type == "content-delta":
+                yield event.delta.message.content.text
+
+class MistralProvider(LLMProvider):
+    name = "mistral"
+
+    def __init__(self, api_key=MISTRAL_API_KEY, model=MISTRAL_MODEL, base_url=MISTRAL_BASE_URL, client=None):
+        self.model = model
+        if client is None:
+            from mistralai import Mistral
+
+            http_client, http_async_client = _http_clients()
+            kwargs = {"server_url": base_url} if base_url else {}
+            client = Mistral(api_key=api_key, client=http_client, async_client=http_async_client, **kwargs)
+        self.client = client
+
+    def chat(self, messages, max_tokens, temperature, timeout):
+        response = self.client.chat.complete(model=self.model, messages=messages, max_tokens=max_tokens,
+                                             temperature=temperature, timeout_ms=int(timeout * 1000))
+        return (response.choices[0].message.content or "").strip()
+
+    async def achat(self, messages, max_tokens, temperature, timeout):
+        response = await self.client.chat.complete_async(model=self.model, messages=messages, max_tokens=max_tokens,
+                                                         temperature=temperature, timeout_ms=int(timeout * 1000))
+        return (response.choices[0].message.content or "").strip()
+
+    def chat_stream(self, messages, max_tokens, temperature, timeout):
+        for event in self.client.chat.stream(model=self.model, messages=messages, max_tokens=max_tokens,
+                                             temperature=temperature, timeout_ms=int(timeout * 1000)):
+            choices = event.data.choices
+            if choices and choices[0].delta.content:
+                yield choices[0].delta.content
+
+class StubProvider(LLMProvider):
+    """Offline provider: canned answers after latency_ms, for tests and demos without API keys."""
+
+    def __init__(self, name="stub", latency_ms=STUB_LATENCY_MS):
+        self.name = name
+        self.model = name
+        self.latency_ms = latency_ms
+
+    def _answer(self, messages):
+        prompt = messages[-1]["content"] if messages else ""
+        return f"[{self.name}] Offline answer for a {len(prompt)}-character prompt."
+
+    def chat(self, messages, max_tokens, temperature, timeout):
+        time.sleep(min(self.latency_ms / 1000.0, timeout))
+        return self._answer(messages)
+
+    async def achat(self, messages, max_tokens, temperature, timeout):
+        await asyncio.sleep(min(self.latency_ms / 1000.0, timeout))
+        return self._answer(messages)
+
+    def chat_stream(self, messages, max_tokens, temperature, timeout):
+        words = self._answer(messages).split()
+        for word in words:
+            time.sleep(min(self.latency_ms / 1000.0, timeout) / len(words))
+            yield word + " "
+
+_FACTORIES = {
+    "cohere": lambda: CohereProvider() if COHERE_API_KEY else None,
+    "mistral": lambda: MistralProvider() if MISTRAL_API_KEY else None,
+    "stub": StubProvider,
+}
+
+def build_providers(names=LLM_PROVIDERS):
+    """Providers named in LLM_PROVIDERS that have a key and an installed SDK; others are skipped with a warning."""
+    providers = []
+    for name in names:
+        factory = _FACTORIES.get(name)
+        if factory is None:
+            logger.warning("Unknown LLM provider %r (expected one of %s)", name, ", ".join(_FACTORIES))
+            continue
+        try:
+            provider = factory()
+        except Exception as e:
+            logger.warning("LLM provider %s not available: %s", name, e)
+            continue
+        if provider is None:
+            logger.error("LLM provider %s has no API key set in environment", name)
+            continue
+        providers.append(provider)
+    return providers
+
+# ------------------------------
+# Router
+# ------------------------------
+class _Route:
+    __slots__ = ("provider", "caller", "stream_caller")
+
+    def __init__(self, provider):
+        self.provider = provider
+        # timeouts, retries, hedging and circuit breaker per provider; streams share the
+        # breaker but track time to first token separately and are never hedged
+        self.caller = ResilientCaller(provider.name)
+        self.stream_caller = ResilientCaller(f"{provider.name}_stream", hedge=False, breaker=self.caller.breaker)
+
+    @property
+    def name(self):
+        return self.provider.name
+
+class LLMRouter:
+    """
+    Sends each request to the fastest healthy provider, judged by the rolling
+    median latency and error rate of its ResilientCaller. Providers whose
+    circuit is open or whose error rate exceeds LLM_MAX_ERROR_RATE go last;
+    providers with no measurements yet go first. When a provider fails, the
+    next one is tried.
+    """
+
+    def __init__(self, providers, explore=LLM_ROUTER_EXPLORE):
+        self.routes = [_Route(p) for p in providers]
+        self.explore = explore
+        self._random = random.Random()
+
+    def __bool__(self):
+        return bool(self.routes)
+
+    @property
+    def identity(self):
+        """The providers and models answers may come from, e.g. for response cache keys."""
+        return ",".join(f"{r.name}:{r.provider.model}" for r in self.routes)
+
+    def ranked(self):
+        def key(route):
+            tracker = route.caller.tracker
+            error_rate = tracker.error_rate()
+            unhealthy = route.caller.breaker.state == "open" or error_rate > LLM_MAX_ERROR_RATE
+            latency = tracker.percentile(50) or 0.0
+            return unhealthy, latency * (1.0 + error_rate)
+
+        routes = sorted(self.routes, key=key)
+        if len(routes) > 1 and self._random.random() < self.explore:
+            routes.insert(0, routes.pop(self._random.randrange(1, len(routes))))
+        return routes
+
+    def health(self):
+        """Per provider: circuit state, rolling latency percentiles (s) and error rate."""
+        return {
+            r.name: {
+                "circuit": r.caller.breaker.state,
+                "p50": r.caller.tracker.percentile(50),
+                "p95": r.caller.tracker.percentile(95),
+                "error_rate": r.caller.tracker.error_rate(),
+                "samples": r.caller.tracker.samples(),
+            }
+            for r in self.routes
+        }
+
+    def _fallback(self, route, e):
+        logger.warning("LLM provider %s failed (%s); trying the next one", route.name, e)
+        metrics.inc("rag_llm_fallbacks_total", provider=route.name, help_text="Requests moved to another provider")
+
+    def _served(self, route):
+        metrics.inc("rag_llm_requests_total", provider=route.name, help_text="LLM requests served per provider")
+        metrics.annotate(llm_provider=route.name)
+
+    def chat(self, messages, max_tokens, temperature):
+        error = None
+        for route in self.ranked():
+            try:
+                text = route.caller.call(lambda timeout: route.provider.chat(messages, max_tokens, temperature, timeout))
+            except Exception as e:
+                error = e
+                self._fallback(route, e)
+                continue
+            self._served(route)
+            return text
+        raise error
+
+    async def achat(self, messages, max_tokens, temperature):
+        error = None
+        for route in self.ranked():
+            try:
+                text = await route.caller.acall(
+                    lambda timeout: route.provider.achat(messages, max_tokens, temperature, timeout))
+            except Exception as e:
+                error = e
+                self._fallback(route, e)
+                continue
+            self._served(route)
+            return text
+        raise error
+
+    def chat_stream(self, messages, max_tokens, temperature):
+        """
+        Text deltas from the first provider that starts streaming. Fallback and
+        retries only happen up to a provider's first delta; a failure after
+        that is raised to the caller.
+        """
+        error = None
+        for route in self.ranked():
+            def open_stream(timeout, provider=route.provider):
+                deltas = iter(provider.chat_stream(messages, max_tokens, temperature, timeout))
+                first = next(deltas, None)
+                return itertools.chain([first] if first is not None else [], deltas)
+
+            try:
+                deltas = route.stream_caller.call(open_stream)
+            except Exception as e:
+                error = e
+                self._fallback(route, e)
+                continue
+            self._served(route)
+            yield from deltas
+            return
+        raise error
+
+_router = None
+_router_lock = Lock()
+
+def get_llm_router():
+    """Process-wide router over LLM_PROVIDERS (built once)."""
+    global _router
+    if _router is not None:
+        return _router
+    with _router_lock:
+        if _router is None:
+            _router = LLMRouter(build_providers())
+    return _router
@@ -0,0 +1,259 @@
+# src/metrics.py
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger("rag.metrics")
+
+# off by default; when off, span()/request() return a shared no-op and inc()/observe() return at once
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+# when set (and metrics are enabled), /metrics is served in Prometheus text format on this port
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+# per-request record collected by request() and filled in by span()/annotate()
+_current = contextvars.ContextVar("rag_metrics_request", default=None)
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+class MetricsRegistry:
+    """In-process counters, histograms and callback gauges, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._buckets = {}  # histogram name -> upper bounds
+        self._callbacks = {}  # name -> [fn returning a number or {labels tuple: number}]
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._types:
+            self._types[name] = kind
+            self._help[name] = help_text
+
+    def inc(self, name, value=1.0, labels=(), help_text=""):
+        with self._lock:
+            self._declare(name, "counter", help_text)
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS, help_text=""):
+        with self._lock:
+            self._declare(name, "histogram", help_text)
+            bounds = self._buckets.setdefault(name, buckets)
+            key = (name, labels)
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * len(bounds) + [0.0, 0]
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def register_callback(self, name, fn, kind="gauge", help_text=""):
+        """
+        Values computed by `fn` when rendering, e.g. from a cache's stats().
+        Several callbacks may share a name if they report different labels.
+        """
+        with self._lock:
+            self._declare(name, kind, help_text)
+            self._callbacks.setdefault(name, []).append(fn)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(state) for key, state in self._histograms.items()}
+            callbacks = {name: list(fns) for name, fns in self._callbacks.items()}
+            types, helps, buckets = dict(self._types), dict(self._help), dict(self._buckets)
+
+        samples = {}  # name -> list of lines
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), state in histograms.items():
+            lines = samples.setdefault(name, [])
+            for bound, count in zip(buckets[name], state):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {state[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {state[-2]:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {state[-1]}")
+        for name, fns in callbacks.items():
+            for fn in fns:
+                try:
+                    value = fn()
+                except Exception:
+                    logger.warning("Metrics callback %s failed", name, exc_info=True)
+                    continue
+                if value is None:
+                    continue
+                values = value if isinstance(value, dict) else {(): value}
+                samples.setdefault(name, []).extend(
+                    f"{name}{_format_labels(labels)} {float(v):g}" for labels, v in values.items()
+                )
+
+        out = []
+        for name in sorted(samples):
+            if helps.get(name):
+                out.append(f"# HELP {name} {helps[name]}")
+            out.append(f"# TYPE {name} {types[name]}")
+            out.extend(samples[name])
+        return "\n".join(out) + "\n"
+
+registry = MetricsRegistry()
+
+if METRICS_ENABLED and not logger.handlers and not logging.getLogger().handlers:
+    # structured request lines go to stderr unless the app configured logging itself
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# ------------------------------
+# Recording helpers (no-ops when METRICS_ENABLED is off)
+# ------------------------------
+class _NoopContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _NoopContext()
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        registry.observe("rag_stage_seconds", elapsed, (("stage", self.stage),),
+                         help_text="Time spent per pipeline stage")
+        record = _current.get()
+        if record is not None:
+            key = f"{self.stage}_ms"
+            record[key] = round(record.get(key, 0.0) + elapsed * 1000.0, 3)
+        return False
+
+class _Request:
+    __slots__ = ("record", "start", "token")
+
+    def __init__(self, name, fields):
+        self.record = {"event": name, **fields}
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.token = _current.set(self.record)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        elapsed = time.perf_counter() - self.start
+        self.record["total_ms"] = round(elapsed * 1000.0, 3)
+        if exc_type is not None:
+            self.record["error"] = exc_type.__name__
+        registry.observe("rag_request_seconds", elapsed, (("entrypoint", self.record["event"]),),
+                         help_text="End-to-end time per entry point")
+        # one structured line per request, with every stage's time
+        logger.info(json.dumps(self.record, default=str))
+        return False
+
+def span(stage):
+    """Times a pipeline stage into rag_stage_seconds{stage=...} and the current request's log record."""
+    return _Span(stage) if METRICS_ENABLED else _NOOP
+
+def request(name, **fields):
+    """Scope of one request: stage spans inside it are collected and logged as one JSON line."""
+    return _Request(name, fields) if METRICS_ENABLED else _NOOP
+
+def annotate(**fields):
+    """Adds fields (sizes, cache outcome, ...) to the current request's log record."""
+    if METRICS_ENABLED:
+        record = _current.get()
+        if record is not None:
+            record.update(fields)
+
+def inc(name, value=1.0, help_text="", **labels):
+    if METRICS_ENABLED:
+        registry.inc(name, value, _labels(labels), help_text=help_text)
+
+def observe(name, value, buckets=LATENCY_BUCKETS, help_text="", **labels):
+    if METRICS_ENABLED:
+        registry.observe(name, value, _labels(labels), buckets=buckets, help_text=help_text)
+
+def register_callback(name, fn, kind="gauge", help_text=""):
+    registry.register_callback(name, fn, kind=kind, help_text=help_text)
+
+def render_prometheus():
+    return registry.render()
+
+# ------------------------------
+# /metrics endpoint
+# ------------------------------
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serves render_prometheus() on http://0.0.0.0:<port>/metrics from a daemon thread (once per process)."""
+    global _server
+    if not (METRICS_ENABLED and port):
+        return None
+    with _server_lock:
+        if _server is not None:
+            return _server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        except OSError:
+            # e.g. another Streamlit process on this box already serves the port
+            logger.warning("Metrics endpoint not started: port %s unavailable", port)
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        return _server
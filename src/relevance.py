@@ -0,0 +1,74 @@
+# src/relevance.py
+import os
+import json
+from dotenv import load_dotenv
+
+try:
+    from src.lexical import document_terms, tokenize
+except Exception:
+    from lexical import document_terms, tokenize
+
+load_dotenv()
+
+# similarity of the best dense hit (cosine, 1 = identical): below MIN the context is weak,
+# at or above HIGH it is trusted outright; in between the query/chunk token overlap decides
+RELEVANCE_MIN_SCORE = float(os.getenv("RELEVANCE_MIN_SCORE", "0.3"))
+RELEVANCE_HIGH_SCORE = float(os.getenv("RELEVANCE_HIGH_SCORE", "0.5"))
+RELEVANCE_TOKEN_THRESHOLD = float(os.getenv("RELEVANCE_TOKEN_THRESHOLD", "0.12"))
+# metadata key holding a chunk's precomputed token set (space-separated), written by ingest.py
+TOKENS_KEY = "tokens"
+
+def chunk_tokens(text: str) -> str:
+    """Token set of a chunk as stored in its metadata at ingest time."""
+    return " ".join(sorted(set(document_terms(text))))
+
+def doc_token_set(doc):
+    md = doc.get("metadata") or {}
+    stored = md.get(TOKENS_KEY)
+    if stored is not None:
+        return set(stored.split())
+    # chunks indexed before token sets were stored
+    return set(document_terms(doc.get("page_content", "")))
+
+def top_score(docs):
+    scores = [d["score"] for d in docs if d.get("score") is not None]
+    return max(scores) if scores else None
+
+def relevance_gate(question: str, docs, min_score=RELEVANCE_MIN_SCORE, high_score=RELEVANCE_HIGH_SCORE,
+                   token_threshold=RELEVANCE_TOKEN_THRESHOLD):
+    """
+    Decide whether the retrieved docs can answer `question`, without touching the context text.
+    Returns (relevant, best similarity score or None).
+    """
+    best = top_score(docs)
+    if best is not None:
+        if best < min_score:
+            return False, best
+        if best >= high_score:
+            return True, best
+    q_tokens = set(tokenize(question))
+    if not q_tokens:
+        return False, best
+    c_tokens = set()
+    for d in docs:
+        c_tokens |= doc_token_set(d)
+    return len(q_tokens & c_tokens) / len(q_tokens) >= token_threshold, best
+
+def doc_issue(doc):
+    """The FAQ `Issue` of a chunk: from its metadata, or parsed from a JSON record."""
+    md = doc.get("metadata") or {}
+    if md.get("Issue"):
+        return md["Issue"]
+    try:
+        record = json.loads(doc.get("page_content", ""))
+    except (ValueError, TypeError):
+        return None
+    return record.get("Issue") if isinstance(record, dict) else None
+
+def clarifying_answer(docs, max_options: int = 3):
+    """Templated clarifying question listing the top candidates' issues (no LLM call)."""
+    issues = list(dict.fromkeys(i.strip() for i in map(doc_issue, docs) if i and i.strip()))[:max_options]
+    if not issues:
+        return "I couldn't find a good match for your question. Could you rephrase it with a bit more detail?"
+    options = "\n".join(f"- {issue}" for issue in issues)
+    return f"I'm not sure I understood your question. Did you mean one of these?\n{options}\n\nPlease pick one or rephrase your question."
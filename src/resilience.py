@@ -0,0 +1,272 @@
+# src/resilience.py
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from threading import Lock, Thread
+from dotenv import load_dotenv
+
+try:
+    import httpx  # transport used by the cohere / mistral SDKs
+    _TRANSPORT_ERRORS = (httpx.TimeoutException, httpx.TransportError)
+except Exception:
+    _TRANSPORT_ERRORS = ()
+
+try:
+    from src import metrics
+except Exception:
+    import metrics
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))  # seconds per attempt
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))  # seconds for all attempts together
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # extra attempts after a retryable error
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "4"))
+# send a second, hedged request when the first is slower than the observed p95
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))  # latencies needed before hedging
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))  # consecutive failures that open the circuit
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))  # seconds before a trial request is let through
+
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the provider while its circuit breaker is open."""
+
+class DeadlineExceeded(TimeoutError):
+    """The overall deadline passed before an attempt succeeded."""
+
+def is_retryable(exc) -> bool:
+    """Timeouts, connection problems, 429 and 5xx responses are worth another attempt."""
+    if isinstance(exc, (TimeoutError, ConnectionError, asyncio.TimeoutError) + _TRANSPORT_ERRORS):
+        return True
+    return getattr(exc, "status_code", None) in RETRYABLE_STATUS
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures; while open
+    every call fails fast. After `reset_timeout` seconds one trial call is let
+    through (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial:
+                    logger.warning("Circuit opened after %d failures", self.failures)
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+class LatencyTracker:
+    """Rolling window of successful call latencies and outcomes."""
+
+    def __init__(self, window=200):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)  # True = success
+        self._lock = Lock()
+
+    def record(self, seconds=None, ok=True):
+        with self._lock:
+            if ok and seconds is not None:
+                self._latencies.append(seconds)
+            self._outcomes.append(ok)
+
+    def percentile(self, q):
+        with self._lock:
+            data = sorted(self._latencies)
+        if not data:
+            return None
+        return data[min(len(data) - 1, int(q / 100.0 * len(data)))]
+
+    def samples(self):
+        with self._lock:
+            return len(self._latencies)
+
+    def error_rate(self):
+        with self._lock:
+            return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+def _start(fn, *args):
+    """
+    Run fn(*args) on its own daemon thread. Hedged attempts don't share a bounded pool:
+    a pool would cap LLM calls in flight across all users, and time spent queued would
+    count against the attempt's timeout.
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    Thread(target=run, name="llm-hedge", daemon=True).start()
+    return future
+
+class ResilientCaller:
+    """
+    Runs provider calls with per-attempt timeouts, an overall deadline,
+    jittered exponential retries for retryable errors, optional p95-based
+    hedging and a circuit breaker.
+
+    `fn(timeout)` must perform one request and honour `timeout` (seconds),
+    e.g. through the SDK's request timeout.
+    """
+
+    def __init__(self, name, timeout=LLM_TIMEOUT, deadline=LLM_DEADLINE, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX, hedge=LLM_HEDGE,
+                 hedge_min_samples=LLM_HEDGE_MIN_SAMPLES, breaker=None, tracker=None):
+        self.name = name
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.tracker = tracker or LatencyTracker()
+
+    def _backoff(self, attempt):
+        # "full jitter": uniform in [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _hedge_delay(self):
+        if not self.hedge or self.tracker.samples() < self.hedge_min_samples:
+            return None
+        return self.tracker.percentile(95)
+
+    def _attempt(self, fn, timeout):
+        start = time.monotonic()
+        result = fn(timeout)
+        self.tracker.record(time.monotonic() - start)
+        return result
+
+    def _attempt_hedged(self, fn, timeout, delay):
+        """First attempt, plus a second one if the first hasn't finished after `delay`."""
+        first = _start(self._attempt, fn, timeout)
+        done, _ = wait([first], timeout=min(delay, timeout))
+        if done:
+            return first.result()
+        logger.info("%s: hedging a request slower than p95 (%.2fs)", self.name, delay)
+        metrics.inc("rag_llm_hedges_total", provider=self.name, help_text="Hedged second requests sent")
+        second = _start(self._attempt, fn, max(0.001, timeout - delay))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error or TimeoutError(f"{self.name}: hedged request timed out")
+
+    def _fail_fast(self):
+        metrics.inc("rag_llm_fail_fast_total", provider=self.name,
+                    help_text="Calls rejected without a request while the circuit was open")
+        return CircuitOpenError(f"{self.name} circuit open; failing fast")
+
+    def _on_error(self, e, attempt, end):
+        """Backoff (seconds) before the next attempt, or None if `e` should be raised."""
+        self.tracker.record(ok=False)
+        if not is_retryable(e):
+            # the provider answered (e.g. 400): it is up, the request is at fault
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        if attempt >= self.max_retries or not self.breaker.allow():
+            return None
+        pause = min(self._backoff(attempt), max(0.0, end - time.monotonic()))
+        logger.warning("%s: attempt %d failed (%s); retrying in %.2fs", self.name, attempt + 1, e, pause)
+        metrics.inc("rag_llm_retries_total", provider=self.name, help_text="LLM requests retried")
+        return pause
+
+    def call(self, fn):
+        if not self.breaker.allow():
+            raise self._fail_fast()
+        end = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record_failure()
+                raise DeadlineExceeded(f"{self.name}: deadline of {self.deadline}s exceeded")
+            timeout = min(self.timeout, remaining)
+            try:
+                delay = self._hedge_delay()
+                result = self._attempt_hedged(fn, timeout, delay) if delay else self._attempt(fn, timeout)
+            except Exception as e:
+                pause = self._on_error(e, attempt, end)
+                if pause is None:
+                    raise
+                time.sleep(pause)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, fn):
+        """Async variant (no hedging): `fn(timeout)` returns an awaitable."""
+        if not self.breaker.allow():
+            raise self._fail_fast()
+        end = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                self.breaker.record_failure()
+                raise DeadlineExceeded(f"{self.name}: deadline of {self.deadline}s exceeded")
+            timeout = min(self.timeout, remaining)
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(fn(timeout), timeout)
+            except Exception as e:
+                pause = self._on_error(e, attempt, end)
+                if pause is None:
+                    raise
+                await asyncio.sleep(pause)
+                attempt += 1
+                continue
+            self.tracker.record(time.monotonic() - start)
+            self.breaker.record_success()
+            return result
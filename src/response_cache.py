@@ -0,0 +1,155 @@
+# src/response_cache.py
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "./response_cache.db")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))  # seconds, 0 = never expire
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))  # 0 disables the cache
+# hits don't write: their last_access times are buffered and written with the next put(),
+# or at most this often (seconds) by a best-effort flush that gives up if the db is busy
+RESPONSE_CACHE_TOUCH_INTERVAL = float(os.getenv("RESPONSE_CACHE_TOUCH_INTERVAL", "30"))
+
+
+def make_key(*parts):
+    """Stable cache key from JSON-serializable parts (question, user_type, model settings...)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match answer cache in SQLite, shared by every process pointing at the same file.
+
+    WAL mode lets readers in other Streamlit workers proceed while one
+    writes; connections are kept per thread. Entries expire after `ttl`
+    seconds and the least recently used ones are pruned beyond `max_entries`.
+    Cache hits are read-only transactions; recency updates are batched.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._touched = {}  # key -> last hit time, not yet written
+        self._touch_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        if self.max_entries > 0:
+            try:
+                self._init_db()
+            except sqlite3.Error:
+                logger.warning("Response cache disabled: cannot open %s", self.path, exc_info=True)
+                self.max_entries = 0
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses (created_at)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Returns (answer, source_documents) or None."""
+        if self.max_entries <= 0:
+            return None
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT answer, sources, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.ttl and now - row[2] > self.ttl:
+                return None  # purged by the next put()
+            with self._touch_lock:
+                self._touched[key] = now
+                flush = time.monotonic() - self._last_flush >= RESPONSE_CACHE_TOUCH_INTERVAL
+            if flush:
+                self._flush_touches(conn, wait=False)
+            return row[0], json.loads(row[1])
+        except sqlite3.Error:
+            # the cache must never break answering
+            logger.warning("Response cache read failed", exc_info=True)
+            return None
+
+    def _flush_touches(self, conn, wait=True):
+        """
+        Write buffered last_access times. With wait=False (from a hit) it is best
+        effort: if another process holds the write lock the times stay buffered.
+        """
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+            self._last_flush = time.monotonic()
+        if not touched:
+            return
+        rows = [(ts, key) for key, ts in touched.items()]
+        if wait:
+            conn.executemany("UPDATE responses SET last_access = MAX(last_access, ?) WHERE key = ?", rows)
+            return
+        try:
+            conn.execute("PRAGMA busy_timeout = 0")
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("UPDATE responses SET last_access = MAX(last_access, ?) WHERE key = ?", rows)
+            conn.commit()
+        except sqlite3.OperationalError:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._touch_lock:
+                for key, ts in touched.items():
+                    self._touched[key] = max(ts, self._touched.get(key, ts))
+        finally:
+            conn.execute("PRAGMA busy_timeout = 5000")
+
+    def put(self, key, answer, source_documents):
+        if self.max_entries <= 0:
+            return
+        try:
+            conn = self._conn()
+            now = time.time()
+            with conn:
+                # recency of recent hits first, so eviction below sees it
+                self._flush_touches(conn)
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, answer, sources, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, answer, json.dumps(source_documents, default=str), now, now),
+                )
+                if self.ttl:
+                    conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                excess = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                        (excess,),
+                    )
+        except sqlite3.Error:
+            logger.warning("Response cache write failed", exc_info=True)
+
+    def clear(self):
+        if self.max_entries > 0:
+            with self._conn() as conn:
+                conn.execute("DELETE FROM responses")
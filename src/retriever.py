@@ -83,67 +83,412 @@
 
 # src/retriever.py
 import os
+import re
+import json
+import time
+from collections import OrderedDict
 from threading import Lock
 from dotenv import load_dotenv
 import chromadb
 from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
 import numpy as np
 
+try:
+    from src.lexical import BM25Index, reciprocal_rank_fusion
+    from src.embeddings import load_embedding_model
+    from src.batching import MicroBatchEncoder, QUERY_BATCH_WAIT_MS
+    from src import metrics
+except Exception:
+    from lexical import BM25Index, reciprocal_rank_fusion
+    from embeddings import load_embedding_model
+    from batching import MicroBatchEncoder, QUERY_BATCH_WAIT_MS
+    import metrics
+
 load_dotenv()
 
 REPO_ROOT = os.environ.get("RENDER_REPO_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 CHROMA_DIR = os.environ.get("INDICES_DIR", os.path.join(REPO_ROOT, "indices"))
 CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", os.path.join(REPO_ROOT, "models"))
+COLLECTION_NAME = os.environ.get("CHROMA_COLLECTION", "faq_data")
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "3600"))  # seconds, 0 = never expire
+INDEX_VERSION_PATH = os.path.join(CHROMA_DIR, "index_version")
+NUMPY_EMBEDDINGS_PATH = os.path.join(CHROMA_DIR, "embeddings.npy")
+NUMPY_CHUNKS_PATH = os.path.join(CHROMA_DIR, "chunks.jsonl")
+# "chroma" (HNSW via chromadb) or "numpy" (exact search over embeddings.npy written by ingest.py)
+RETRIEVER_BACKEND = os.environ.get("RETRIEVER_BACKEND", "chroma").lower()
+BM25_INDEX_PATH = os.path.join(CHROMA_DIR, "bm25_index.json")
+# "dense" (embeddings only) or "hybrid" (BM25 + dense, fused with reciprocal rank fusion)
+RETRIEVER_MODE = os.environ.get("RETRIEVER_MODE", "dense").lower()
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))  # per ranking, before fusion
+RRF_K = int(os.environ.get("RRF_K", "60"))
+# user_type that ingest.py stores on chunks applying to every platform
+ALL_USER_TYPES = "all"
+# user types that mean "no platform preference", i.e. no filter
+_UNFILTERED_USER_TYPES = {"", "general", ALL_USER_TYPES}
 
 # singletons
 _client = None
 _collection = None
+_collection_version = None  # index version _collection was resolved at
 _embedding_model = None
 _lock = Lock()
+_numpy_index = None  # (index version, NumpyIndex)
+_lexical_index = None  # (index version, BM25Index)
+_index_version = (None, "")  # (mtime, version)
+
+# ------------------------------
+# Query embedding cache
+# ------------------------------
+_whitespace = re.compile(r"\s+")
+
+def normalize_query(text: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used as a cache key."""
+    return _whitespace.sub(" ", (text or "").strip().lower())
+
+class QueryEmbeddingCache:
+    """Thread-safe LRU of normalized query text -> embedding vector, with optional TTL."""
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                vec, stored_at = item
+                if not self.ttl or time.monotonic() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return vec
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, vec):
+        if self.maxsize <= 0:
+            return
+        vec.setflags(write=False)  # shared between callers
+        with self._lock:
+            self._data[key] = (vec, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+_query_cache = QueryEmbeddingCache()
+
+def query_cache_stats():
+    return _query_cache.stats()
+
+def query_batcher_stats():
+    """Queue-depth / batch-size metrics of the query encoder, or None when micro-batching is off."""
+    model = _embedding_model
+    return model.stats() if isinstance(model, MicroBatchEncoder) else None
+
+def _batcher_stat(key):
+    stats = query_batcher_stats()
+    return stats[key] if stats else None
+
+metrics.register_callback(
+    "rag_cache_hits_total", lambda: {(("cache", "query_embedding"),): _query_cache.hits},
+    kind="counter", help_text="Cache hits per cache")
+metrics.register_callback(
+    "rag_cache_misses_total", lambda: {(("cache", "query_embedding"),): _query_cache.misses},
+    kind="counter", help_text="Cache misses per cache")
+metrics.register_callback("rag_embed_queue_depth", lambda: _batcher_stat("queue_depth"),
+                          help_text="Texts waiting in the query micro-batcher")
+metrics.register_callback("rag_embed_batch_size_avg", lambda: _batcher_stat("avg_batch_size"),
+                          help_text="Average texts per micro-batch")
+
+def user_type_partitions(user_type):
+    """The chunk user_types a query for `user_type` may match, or None for no filtering."""
+    ut = (user_type or "").strip().lower()
+    if ut in _UNFILTERED_USER_TYPES:
+        return None
+    return (ut, ALL_USER_TYPES)
+
+def distance_to_similarity(distance, space="l2"):
+    """Chroma distance -> cosine similarity (chunk and query embeddings are L2-normalized)."""
+    if space == "l2":
+        return 1.0 - distance / 2.0  # squared L2 between unit vectors is 2 - 2 cos
+    return 1.0 - distance  # "cosine" and "ip" distances are 1 - dot product
+
+def get_index_version():
+    """Version string written by ingest.py on every index change ("" if never written)."""
+    global _index_version
+    try:
+        mtime = os.stat(INDEX_VERSION_PATH).st_mtime_ns
+    except OSError:
+        return ""
+    if mtime != _index_version[0]:
+        with open(INDEX_VERSION_PATH, "r", encoding="utf-8") as f:
+            _index_version = (mtime, f.read().strip())
+    return _index_version[1]
 
 def _init_chroma():
-    global _client, _collection
-    if _client is not None and _collection is not None:
+    """Resolve the collection, again whenever the index version changes (a full rebuild recreates it)."""
+    global _client, _collection, _collection_version
+    version = get_index_version()
+    if _collection is not None and _collection_version == version:
         return
-    # persistent client points at directory where Chroma persisted data exists
-    _client = chromadb.PersistentClient(path=CHROMA_DIR)
-    # adjust collection name to what you used in ingest.py
-    _collection = _client.get_or_create_collection("faq_data")
+    if _client is None:
+        # persistent client points at directory where Chroma persisted data exists
+        _client = chromadb.PersistentClient(path=CHROMA_DIR)
+    # must match the collection name used in ingest.py
+    _collection = _client.get_or_create_collection(COLLECTION_NAME)
+    _collection_version = version
     return
 
+class Retriever:
+    def __init__(self, collection, embed_model, k, lexical=None):
+        self.collection = collection
+        self.embed_model = embed_model
+        self.k = k
+        # distance function of the collection, for turning distances into similarity scores
+        self.space = ((getattr(collection, "metadata", None) or {}).get("hnsw:space") or "l2") if collection else "cosine"
+        # optional BM25Index; when set, results fuse lexical and dense rankings
+        self.lexical = lexical
+
+    def embed_query(self, query):
+        """Embedding for `query`, served from the query cache when possible."""
+        key = normalize_query(query)
+        emb = _query_cache.get(key)
+        if emb is None:
+            # MiniLM is uncased, so encoding the normalized text gives the same vector
+            with metrics.span("query_encode"):
+                emb = self.embed_model.encode([key], convert_to_numpy=True, show_progress_bar=False)[0]
+            _query_cache.put(key, emb)
+        return emb
+
+    def embed_queries(self, queries):
+        """Embeddings for many queries; cache misses are encoded in a single batched call."""
+        keys = [normalize_query(q) for q in queries]
+        embs = [_query_cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, emb in zip(keys, embs) if emb is None))
+        if missing:
+            with metrics.span("query_encode"):
+                encoded = dict(zip(missing, self.embed_model.encode(missing, convert_to_numpy=True, show_progress_bar=False)))
+            for key, emb in encoded.items():
+                _query_cache.put(key, emb)
+            embs = [emb if emb is not None else encoded[key] for key, emb in zip(keys, embs)]
+        return embs
+
+    def _docs_from_result(self, res, row):
+        docs = []
+        distances = res.get("distances")
+        for i in range(len(res["documents"][row])):
+            distance = distances[row][i] if distances else None
+            docs.append({
+                "id": res["ids"][row][i],
+                "page_content": res["documents"][row][i],
+                "metadata": res["metadatas"][row][i],
+                "distance": distance,
+                "score": distance_to_similarity(distance, self.space) if distance is not None else None,
+            })
+        return docs
+
+    def _dense_search(self, embs, n, partitions=None):
+        """Top-n docs per embedding, restricted to chunks whose user_type is in `partitions`."""
+        # query Chroma by passing precomputed embeddings; the filter is applied inside the search
+        where = {"user_type": {"$in": list(partitions)}} if partitions else None
+        res = self.collection.query(
+            query_embeddings=[emb.tolist() for emb in embs], n_results=n, where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [self._docs_from_result(res, row) for row in range(len(embs))]
+
+    def _fetch(self, ids):
+        """Docs by chunk id, in the order given."""
+        res = self.collection.get(ids=list(ids), include=["documents", "metadatas"])
+        by_id = {
+            cid: {"id": cid, "page_content": doc, "metadata": md, "distance": None, "score": None}
+            for cid, doc, md in zip(res["ids"], res["documents"], res["metadatas"])
+        }
+        return [by_id[cid] for cid in ids if cid in by_id]
+
+    def _fuse(self, query, dense_docs, partitions=None):
+        """Reciprocal rank fusion of the dense candidates with BM25 hits for the same query."""
+        hits = self.lexical.search(query, HYBRID_CANDIDATES, partitions=partitions)
+        lexical_ids = [self.lexical.ids[row] for row, _ in hits]
+        fused_ids = reciprocal_rank_fusion([[d["id"] for d in dense_docs], lexical_ids], k=RRF_K)[:self.k]
+        by_id = {d["id"]: d for d in dense_docs}
+        missing = [cid for cid in fused_ids if cid not in by_id]
+        if missing:
+            by_id.update((d["id"], d) for d in self._fetch(missing))
+        return [by_id[cid] for cid in fused_ids if cid in by_id]
+
+    def _search(self, queries, embs, user_type=None):
+        partitions = user_type_partitions(user_type)
+        with metrics.span("vector_search"):
+            dense = self._dense_search(embs, self.k if self.lexical is None else max(self.k, HYBRID_CANDIDATES), partitions)
+        if self.lexical is None:
+            return dense
+        with metrics.span("hybrid_fusion"):
+            return [self._fuse(query, docs, partitions) for query, docs in zip(queries, dense)]
+
+    def get_relevant_documents(self, query, user_type=None, embedding=None):
+        """
+        Top-k docs for `query`; with a user_type, only that platform's and platform-agnostic chunks.
+        Pass `embedding` when the caller already encoded the query, so it isn't encoded again.
+        """
+        if embedding is None:
+            embedding = self.embed_query(query)
+        return self._search([query], [embedding], user_type)[0]
+
+    def get_relevant_documents_batch(self, queries, user_type=None, embeddings=None):
+        """Top-k docs for each query, using one batched encode and one multi-embedding Chroma query."""
+        if not queries:
+            return []
+        if embeddings is None:
+            embeddings = self.embed_queries(queries)
+        return self._search(queries, embeddings, user_type)
+
+class NumpyIndex:
+    """
+    embeddings.npy + chunks.jsonl with the lookups derived from them, built once
+    per index version and shared by every NumpyRetriever (one per request).
+    """
+
+    def __init__(self, matrix, ids, documents, metadatas):
+        self.matrix = matrix
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.row_of = {cid: row for row, cid in enumerate(ids)}
+        self.partitions = np.asarray([(md or {}).get("user_type") for md in metadatas], dtype=object)
+        self._allowed_rows = {}
+
+    def allowed(self, partitions):
+        """Row indices of the per-partition sub-index (cached)."""
+        rows = self._allowed_rows.get(partitions)
+        if rows is None:
+            rows = self._allowed_rows[partitions] = np.flatnonzero(np.isin(self.partitions, list(partitions)))
+        return rows
+
+class NumpyRetriever(Retriever):
+    """
+    Exact top-k search over an in-memory (memory-mapped) matrix of normalized
+    chunk embeddings. Drop-in replacement for Retriever on small corpora,
+    where HNSW and the chromadb client are pure overhead.
+    """
+
+    def __init__(self, index, embed_model, k, lexical=None):
+        super().__init__(None, embed_model, k, lexical=lexical)
+        self.index = index
+        self.matrix = index.matrix
+        self.ids = index.ids
+        self.documents = index.documents
+        self.metadatas = index.metadatas
+        self.row_of = index.row_of
+
+    @staticmethod
+    def _top_n(scores, n):
+        n = min(n, len(scores))
+        if n <= 0:
+            return []
+        idx = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+        return idx[np.argsort(-scores[idx])]
+
+    def _docs_for(self, idx, scores=None):
+        return [
+            {"id": self.ids[i], "page_content": self.documents[i], "metadata": self.metadatas[i],
+             "distance": 1.0 - float(scores[i]) if scores is not None else None,
+             "score": float(scores[i]) if scores is not None else None}
+            for i in idx
+        ]
+
+    @staticmethod
+    def _unit(vecs):
+        vecs = np.asarray(vecs, dtype=np.float32)
+        norms = np.linalg.norm(vecs, axis=-1, keepdims=True)
+        return vecs / np.where(norms == 0, 1, norms)
+
+    def _dense_search(self, embs, n, partitions=None):
+        # one matrix-vector product per query (one matrix product for a batch)
+        scores = self._unit(np.vstack(embs)) @ self.matrix.T
+        if partitions is None:
+            return [self._docs_for(self._top_n(row, n), row) for row in scores]
+        rows = self.index.allowed(partitions)
+        return [self._docs_for(rows[self._top_n(row[rows], n)], row) for row in scores]
+
+    def _fetch(self, ids):
+        return self._docs_for([self.row_of[cid] for cid in ids if cid in self.row_of])
+
+def _load_numpy_index():
+    """Memory-map embeddings.npy and load chunks.jsonl, reloading when the index version changes."""
+    global _numpy_index
+    version = get_index_version()
+    if _numpy_index is not None and _numpy_index[0] == version:
+        return _numpy_index[1]
+    if not (os.path.exists(NUMPY_EMBEDDINGS_PATH) and os.path.exists(NUMPY_CHUNKS_PATH)):
+        raise FileNotFoundError(
+            f"No exact-search index found at {NUMPY_EMBEDDINGS_PATH}. Please run ingest.py first."
+        )
+    matrix = np.load(NUMPY_EMBEDDINGS_PATH, mmap_mode="r")
+    ids, documents, metadatas = [], [], []
+    with open(NUMPY_CHUNKS_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            chunk = json.loads(line)
+            ids.append(chunk["id"])
+            documents.append(chunk["document"])
+            metadatas.append(chunk["metadata"])
+    _numpy_index = (version, NumpyIndex(matrix, ids, documents, metadatas))
+    return _numpy_index[1]
+
+def _load_lexical_index():
+    """Load the BM25 index written by ingest.py, reloading when the index version changes."""
+    global _lexical_index
+    version = get_index_version()
+    if _lexical_index is not None and _lexical_index[0] == version:
+        return _lexical_index[1]
+    if not os.path.exists(BM25_INDEX_PATH):
+        raise FileNotFoundError(f"No BM25 index found at {BM25_INDEX_PATH}. Please run ingest.py first.")
+    _lexical_index = (version, BM25Index.load(BM25_INDEX_PATH))
+    return _lexical_index[1]
+
 def load_retriever(k=3):
 
     global _embedding_model
     with _lock:
-        if _collection is None:
-            if not os.path.exists(CHROMA_DIR):
+        if RETRIEVER_BACKEND == "numpy":
+            numpy_index = _load_numpy_index()
+        else:
+            if _collection is None and not os.path.exists(CHROMA_DIR):
                 raise FileNotFoundError(f"No vector database found at {CHROMA_DIR}. Please run ingest.py first.")
             _init_chroma()
 
+        lexical = _load_lexical_index() if RETRIEVER_MODE == "hybrid" else None
+
         if _embedding_model is None:
-            # Load the small sentence-transformers model from the cache folder (downloaded by download.py)
-            _embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2', cache_folder=CACHE_DIR)
-
-    class Retriever:
-        def __init__(self, collection, embed_model, k):
-            self.collection = collection
-            self.embed_model = embed_model
-            self.k = k
-
-        def get_relevant_documents(self, query):
-            emb = self.embed_model.encode([query], convert_to_numpy=True, show_progress_bar=False)[0]
-            # query Chroma by passing precomputed embedding
-            res = self.collection.query(query_embeddings=[emb.tolist()], n_results=self.k)
-            docs = []
-            for i in range(len(res["documents"][0])):
-                docs.append({
-                    "page_content": res["documents"][0][i],
-                    "metadata": res["metadatas"][0][i]
-                })
-            return docs
-
-    return Retriever(_collection, _embedding_model, k=k)
+            # SentenceTransformer or quantized ONNX model, per EMBEDDING_BACKEND
+            _embedding_model = load_embedding_model()
+            if QUERY_BATCH_WAIT_MS > 0:
+                # concurrent sessions' queries are encoded together instead of one by one
+                _embedding_model = MicroBatchEncoder(_embedding_model)
+
+    if RETRIEVER_BACKEND == "numpy":
+        return NumpyRetriever(numpy_index, _embedding_model, k=k, lexical=lexical)
+    return Retriever(_collection, _embedding_model, k=k, lexical=lexical)
 
 # convenience wrappers for backward compatibility
 def get_retriever(k=3):
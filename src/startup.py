@@ -0,0 +1,111 @@
+# src/startup.py
+# Measured, lazy startup for the Streamlit app. Only the standard library is
+# imported here, so the page can render before chromadb / sentence-transformers /
+# torch / cohere are loaded; the pipeline is loaded once per process on a
+# background thread and each step is timed for the startup report.
+import os
+import time
+import socket
+import logging
+import importlib
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_report = []  # (stage, seconds) in the order they completed
+_report_lock = threading.Lock()
+
+def record(stage, seconds):
+    with _report_lock:
+        _report.append((stage, seconds))
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def startup_report():
+    """List of (stage, seconds) recorded so far in this process."""
+    with _report_lock:
+        return list(_report)
+
+def timed_import(module_name):
+    with timed(f"import {module_name}"):
+        return importlib.import_module(module_name)
+
+def _import_local(module_name):
+    # support both top-level (streamlit run src/app.py) and src.* imports
+    try:
+        return timed_import(module_name)
+    except ModuleNotFoundError as e:
+        if e.name != module_name:
+            raise
+        return timed_import(f"src.{module_name}")
+
+def _heavy_modules():
+    # imported one by one first so each third-party package's cost is reported separately
+    return ["numpy", "chromadb", "cohere"]
+
+def _backend_module(embeddings):
+    """Third-party module behind the embedding model, or None when a shared embedding server looks available."""
+    family, addr = embeddings.parse_server_address(embeddings.EMBEDDING_SERVER)
+    if embeddings.EMBEDDING_SERVER.lower() != "off" and (family != socket.AF_UNIX or os.path.exists(addr)):
+        return None
+    return "onnxruntime" if embeddings.EMBEDDING_BACKEND == "onnx" else "sentence_transformers"
+
+class Warmup:
+    """Loads the RAG pipeline on a background thread; callers wait() for it when they need it."""
+
+    def __init__(self):
+        self.generator = None
+        self.error = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rag-warmup", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _import_optional(module_name):
+        try:
+            timed_import(module_name)
+        except ImportError:
+            logger.warning("Optional module %s not available", module_name)
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            for module_name in _heavy_modules():
+                self._import_optional(module_name)
+            generator = _import_local("generator")
+            retriever = _import_local("retriever")
+            embeddings = _import_local("embeddings")
+            backend = _backend_module(embeddings)
+            if backend:
+                self._import_optional(backend)
+            with timed("model load"):
+                embeddings.load_embedding_model()
+            with timed("index open"):
+                retriever.load_retriever()
+            self.generator = generator
+        except Exception as e:
+            # surfaced to the UI via wait(); the app stays usable for tickets etc.
+            logger.exception("Warm-up failed")
+            self.error = e
+        finally:
+            record("total warm-up", time.perf_counter() - start)
+            self._done.set()
+            logger.info("Startup report: %s", ", ".join(f"{stage}={sec:.3f}s" for stage, sec in startup_report()))
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until warm-up finishes; returns the generator module or raises the warm-up error."""
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.generator
@@ -0,0 +1,149 @@
+# src/ticket_store.py
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TICKETS_DB_PATH = os.getenv("TICKETS_DB_PATH", "./tickets.db")
+TICKETS_PAGE_SIZE = int(os.getenv("TICKETS_PAGE_SIZE", "10"))
+OPEN_STATUS = "open"
+
+_store = None
+_lock = threading.Lock()
+
+class TicketStore:
+    """
+    Support tickets in SQLite.
+
+    Connections are reused per thread and the database runs in WAL mode so
+    sidebar reads in one session don't block a ticket being written in
+    another. The number of open tickets is kept in `ticket_stats` by
+    triggers, so counting never scans the tickets table.
+    """
+
+    def __init__(self, path=TICKETS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS tickets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                issue TEXT NOT NULL,
+                answer_provided TEXT,
+                timestamp TEXT NOT NULL,
+                status TEXT DEFAULT 'open'
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets (status, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_platform ON tickets (platform, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_timestamp ON tickets (timestamp)")
+        conn.execute("CREATE TABLE IF NOT EXISTS ticket_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS tickets_open_insert AFTER INSERT ON tickets
+            WHEN NEW.status IS 'open'
+            BEGIN
+                UPDATE ticket_stats SET value = value + 1 WHERE name = 'open_tickets';
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS tickets_open_delete AFTER DELETE ON tickets
+            WHEN OLD.status IS 'open'
+            BEGIN
+                UPDATE ticket_stats SET value = value - 1 WHERE name = 'open_tickets';
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS tickets_open_update AFTER UPDATE OF status ON tickets
+            WHEN (OLD.status IS 'open') != (NEW.status IS 'open')
+            BEGIN
+                UPDATE ticket_stats SET value = value + (NEW.status IS 'open') - (OLD.status IS 'open')
+                WHERE name = 'open_tickets';
+            END
+        ''')
+        # seed the counter once, for databases created before it existed
+        conn.execute(
+            "INSERT OR IGNORE INTO ticket_stats (name, value) "
+            "SELECT 'open_tickets', COUNT(*) FROM tickets WHERE status = ?",
+            (OPEN_STATUS,),
+        )
+        conn.commit()
+
+    def save_ticket(self, user, platform, issue, answer_provided):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._conn() as conn:
+            cursor = conn.execute('''
+                INSERT INTO tickets (user, platform, issue, answer_provided, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user, platform, issue, answer_provided, timestamp))
+        return cursor.lastrowid
+
+    def set_status(self, ticket_id, status):
+        with self._conn() as conn:
+            conn.execute("UPDATE tickets SET status = ? WHERE id = ?", (status, ticket_id))
+
+    def get_all_tickets(self):
+        return self._conn().execute('''
+            SELECT id, user, platform, issue, answer_provided, timestamp, status
+            FROM tickets
+            ORDER BY id DESC
+        ''').fetchall()
+
+    def get_tickets_page(self, before_id=None, limit=TICKETS_PAGE_SIZE, status=None, platform=None):
+        """
+        One page of tickets, newest first, with id < before_id (keyset pagination).
+
+        Returns (rows, next_before_id); next_before_id is None on the last page.
+        Each page is an index range scan, however deep into the table it is.
+        """
+        clauses, params = [], []
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(before_id)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        if platform:
+            clauses.append("platform = ?")
+            params.append(platform)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(f'''
+            SELECT id, user, platform, issue, answer_provided, timestamp, status
+            FROM tickets
+            {where}
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (*params, limit + 1)).fetchall()
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1][0]
+        return rows, None
+
+    def get_ticket_count(self):
+        """Number of open tickets (maintained by triggers, no table scan)."""
+        row = self._conn().execute("SELECT value FROM ticket_stats WHERE name = 'open_tickets'").fetchone()
+        return row[0] if row else 0
+
+def get_ticket_store():
+    """Process-wide TicketStore for TICKETS_DB_PATH (schema set up once)."""
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = TicketStore()
+    return _store